@@ -1,23 +1,41 @@
+import asyncio
 import base64
+import gzip
 import hashlib
 import json
 import logging
 import secrets
+import threading
 import time
-from fastapi import APIRouter, HTTPException, Depends, Request
+from functools import cached_property, partial
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, Request
 from fastapi.responses import HTMLResponse
-from pydantic import BaseModel, EmailStr, field_validator
-from typing import Optional
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, StringConstraints
+from typing import Annotated, Optional
+from urllib.parse import quote
+from supabase import Client
 
 from app.core.config import settings
 from app.core.database import get_supabase, get_supabase_anon
 from app.core.auth import get_current_user
+from app.core.responses import ORJSONResponse
 from app.services.rate_limiter import check_rate_limit_by_ip
 
 logger = logging.getLogger(__name__)
 
 _TOKEN_TTL = 120    # 2 minutes
 _PKCE_TTL = 300     # 5 minutes
+_USER_CACHE_TTL = 300       # 5 minutes
+_USER_CACHE_MAX = 10_000    # entries per worker
+_REFRESH_INFLIGHT_MAX = 1_000
+
+# Static parts of the Google OAuth URL built by /auth/login. Only the PKCE
+# challenge and the nonce-bearing redirect_to vary per request.
+_AUTHORIZE_URL_PREFIX = (
+    f"{settings.SUPABASE_URL}/auth/v1/authorize"
+    "?provider=google&prompt=select_account&code_challenge_method=S256"
+)
+_OAUTH_REDIRECT_PATH = f"{settings.API_PREFIX}/auth/oauth-complete?nonce="
 
 
 def _get_redis():
@@ -33,7 +51,7 @@ def _get_redis():
         client.ping()
         return client
     except Exception as e:
-        logger.warning(f"Redis unavailable for auth store: {e}")
+        logger.warning("Redis unavailable for auth store: %s", e)
         return None
 
 
@@ -47,7 +65,7 @@ def _store_token(nonce: str, token_data: dict) -> None:
         key = f"oauth_token:{nonce}"
         r.setex(key, _TOKEN_TTL, json.dumps(token_data, default=str))
     except Exception as e:
-        logger.error(f"Failed to store OAuth token in Redis: {e}")
+        logger.error("Failed to store OAuth token in Redis: %s", e)
 
 
 def _pop_token(nonce: str) -> dict | None:
@@ -62,7 +80,7 @@ def _pop_token(nonce: str) -> dict | None:
             return json.loads(raw)
         return None
     except Exception as e:
-        logger.error(f"Failed to pop OAuth token from Redis: {e}")
+        logger.error("Failed to pop OAuth token from Redis: %s", e)
         return None
 
 
@@ -76,7 +94,7 @@ def _store_pkce_verifier(nonce: str, verifier: str) -> None:
         key = f"pkce:{nonce}"
         r.setex(key, _PKCE_TTL, verifier)
     except Exception as e:
-        logger.error(f"Failed to store PKCE verifier in Redis: {e}")
+        logger.error("Failed to store PKCE verifier in Redis: %s", e)
 
 
 def _pop_pkce_verifier(nonce: str) -> str | None:
@@ -88,7 +106,7 @@ def _pop_pkce_verifier(nonce: str) -> str | None:
         key = f"pkce:{nonce}"
         return r.getdel(key)
     except Exception as e:
-        logger.error(f"Failed to pop PKCE verifier from Redis: {e}")
+        logger.error("Failed to pop PKCE verifier from Redis: %s", e)
         return None
 
 
@@ -100,19 +118,36 @@ def _generate_pkce_pair() -> tuple[str, str]:
     ).rstrip(b"=").decode()
     return verifier, challenge
 
-router = APIRouter(prefix="/auth", tags=["Authentication"])
+router = APIRouter(
+    prefix="/auth",
+    tags=["Authentication"],
+    default_response_class=ORJSONResponse,
+)
 
 
 def _get_client_ip(request: Request) -> str:
-    """Extract client IP, respecting X-Forwarded-For for proxied requests."""
+    """Extract client IP, respecting X-Forwarded-For for proxied requests.
+
+    Memoized on request.state so later dependencies reuse the parsed value.
+    """
+    ip = getattr(request.state, "client_ip", None)
+    if ip:
+        return ip
     forwarded = request.headers.get("x-forwarded-for")
     if forwarded:
-        return forwarded.split(",")[0].strip()
-    return request.client.host if request.client else "unknown"
+        ip = forwarded.partition(",")[0].strip()
+    else:
+        ip = request.client.host if request.client else "unknown"
+    request.state.client_ip = ip
+    return ip
 
 
 def _check_auth_rate_limit(request: Request, action: str):
-    """Check IP-based rate limit for auth endpoints. Raises 429 if exceeded."""
+    """Check IP-based rate limit for auth endpoints. Raises 429 if exceeded.
+
+    Most requests are admitted from a block this worker already reserved on
+    the shared counter, so only one in every few pays the Redis round-trip.
+    """
     ip = _get_client_ip(request)
     rate = check_rate_limit_by_ip(ip, action)
     if not rate["allowed"]:
@@ -127,7 +162,140 @@ def _check_auth_rate_limit(request: Request, action: str):
         )
 
 
+def _ensure_user_record(sb, record: dict) -> dict:
+    """Return the users-table row for record["id"], creating it if missing.
+
+    Uses the ensure_user RPC (migrations/003) — one round-trip, race-free.
+    Falls back to select-then-insert if the function isn't deployed yet.
+    """
+    try:
+        result = sb.rpc("ensure_user", {
+            "p_id": record["id"],
+            "p_email": record["email"],
+            "p_name": record["name"],
+            "p_google_id": record.get("google_id"),
+            "p_avatar_url": record.get("avatar_url"),
+        }).execute()
+        if result.data:
+            return result.data[0]
+    except Exception as e:
+        logger.warning("ensure_user RPC unavailable, using select+insert: %s", e)
+
+    existing = sb.table("users").select("*").eq("id", record["id"]).execute()
+    if existing.data:
+        return existing.data[0]
+    return sb.table("users").insert(record).execute().data[0]
+
+
+# ---------------------------------------------------------------------------
+# In-process cache of users-table rows returned by signin/callback
+# ---------------------------------------------------------------------------
+# The row is mostly cosmetic in the auth response (get_current_user re-reads
+# it on every authenticated request), so a returning user can be answered
+# from here while the mirror write runs after the response is sent.
+# Structure: {user_id: (stored_at, user_record)}
+
+_user_cache_lock = threading.Lock()
+_user_cache: dict[str, tuple[float, dict]] = {}
+
+
+def _get_cached_user(user_id: str) -> dict | None:
+    """Return a cached users row if it is younger than _USER_CACHE_TTL."""
+    with _user_cache_lock:
+        entry = _user_cache.get(user_id)
+    if entry is None or time.monotonic() - entry[0] > _USER_CACHE_TTL:
+        return None
+    return entry[1]
+
+
+def _cache_user(user_record: dict) -> None:
+    """Store a users row, evicting the oldest entry when the cache is full."""
+    with _user_cache_lock:
+        _user_cache.pop(user_record["id"], None)
+        if len(_user_cache) >= _USER_CACHE_MAX:
+            _user_cache.pop(next(iter(_user_cache)))
+        _user_cache[user_record["id"]] = (time.monotonic(), user_record)
+
+
+def _mirror_user(record: dict) -> None:
+    """Background task: make sure the users row exists and refresh the cache."""
+    try:
+        _cache_user(_ensure_user_record(get_supabase(), record))
+    except Exception as e:
+        logger.warning("users table mirror for %s failed: %s", record["id"], e)
+
+
+async def _run_blocking(fn, *args):
+    """Run a blocking supabase-py call in the default thread pool.
+
+    supabase-py's sync client would otherwise stall the event loop for the
+    full round-trip to Supabase, serializing every auth request on the worker.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(fn, *args))
+
+
+# In-flight /refresh exchanges keyed by a hash of the refresh token. Tabs
+# waking up together send the same token at once; the first request calls
+# Supabase and the rest await its result instead of racing token rotation.
+_refresh_inflight: dict[str, asyncio.Future] = {}
+
+
+async def _refresh_session_coalesced(client: Client, refresh_token: str):
+    """Exchange a refresh token, sharing one upstream call per token.
+
+    The call runs as its own task that every caller (the first included)
+    awaits through a shield, so a disconnecting client never cancels it:
+    the rotated session still reaches the other waiters. Failures are
+    propagated to every waiter but never cached — the entry is removed as
+    soon as the call settles.
+    """
+    key = hashlib.blake2b(refresh_token.encode(), digest_size=16).hexdigest()
+    task = _refresh_inflight.get(key)
+    if task is None:
+        if len(_refresh_inflight) >= _REFRESH_INFLIGHT_MAX:
+            return await _run_blocking(client.auth.refresh_session, refresh_token)
+        task = asyncio.ensure_future(_run_blocking(client.auth.refresh_session, refresh_token))
+        _refresh_inflight[key] = task
+        task.add_done_callback(partial(_refresh_settled, key))
+    return await asyncio.shield(task)
+
+
+def _refresh_settled(key: str, task: asyncio.Future) -> None:
+    if _refresh_inflight.get(key) is task:
+        del _refresh_inflight[key]
+    # Mark the exception as retrieved even when every caller has gone
+    if not task.cancelled():
+        task.exception()
+
+
+async def _user_record_for(record: dict, background: BackgroundTasks) -> dict:
+    """Return the users row for a freshly authenticated user.
+
+    Cache hit: answer immediately and refresh the row in the background.
+    Cache miss: ensure the row inline (its contents are part of the response).
+    """
+    user_record = _get_cached_user(record["id"])
+    if user_record is not None:
+        background.add_task(_mirror_user, record)
+        return user_record
+    user_record = await _run_blocking(_ensure_user_record, get_supabase(), record)
+    _cache_user(user_record)
+    return user_record
+
+
+# Shared by all auth request bodies: reject unknown fields and strip stray
+# whitespace from pasted tokens/emails. Bodies are never mutated.
+_AUTH_BODY_CONFIG = ConfigDict(extra="forbid", str_strip_whitespace=True, frozen=True)
+
+# Passwords are compared verbatim by Supabase — never strip or lowercase them.
+_Password = Annotated[str, StringConstraints(strip_whitespace=False, to_lower=False)]
+_DisplayName = Annotated[str, StringConstraints(to_lower=False)]
+
+
 class TokenRequest(BaseModel):
+    model_config = _AUTH_BODY_CONFIG
+
     # Implicit flow
     access_token: str = ""
     refresh_token: str = ""
@@ -137,92 +305,38 @@ class TokenRequest(BaseModel):
 
 
 class RefreshRequest(BaseModel):
-    refresh_token: str
-
+    model_config = _AUTH_BODY_CONFIG
 
-class SignUpRequest(BaseModel):
-    email: EmailStr
-    password: str
-    name: Optional[str] = None
+    refresh_token: str
 
-    @field_validator("password")
-    @classmethod
-    def validate_password(cls, v: str) -> str:
-        if len(v) < 8:
-            raise ValueError("Password must be at least 8 characters long.")
-        if len(v) > 128:
-            raise ValueError("Password must not exceed 128 characters.")
-        return v
 
+class _EmailBody(BaseModel):
+    # GoTrue stores emails lowercased; normalizing here keeps users-table
+    # mirror rows and cache keys consistent with what Auth returns.
+    model_config = ConfigDict(**_AUTH_BODY_CONFIG, str_to_lower=True)
 
-class SignInRequest(BaseModel):
     email: EmailStr
-    password: str
 
+    @cached_property
+    def email_local(self) -> str:
+        """Part of the email before the @ — the default display name."""
+        return self.email.split("@", 1)[0]
 
-@router.get("/login")
-async def login(request: Request, nonce: str = ""):
-    """
-    Return the Supabase OAuth URL for Google login using PKCE flow.
 
-    PKCE (Proof Key for Code Exchange) is the modern, secure OAuth flow:
-    1. We generate a code_verifier (random secret) + code_challenge (SHA-256 hash).
-    2. The code_challenge is sent to Supabase in the auth URL.
-    3. After login, Supabase redirects to /oauth-complete with ?code=AUTH_CODE.
-    4. The page sends code + nonce back to the opener via postMessage.
-    5. The frontend calls /auth/callback with code + nonce.
-    6. We look up the stored verifier by nonce and exchange the code for tokens.
+class SignUpRequest(_EmailBody):
+    # Length limits are enforced by pydantic-core, no Python validator needed
+    password: Annotated[_Password, Field(min_length=8, max_length=128)]
+    name: Optional[_DisplayName] = None
 
-    The nonce ties the postMessage back to the original request (CSRF protection).
-    The code_verifier is stored server-side keyed by nonce (5-min TTL).
-    """
-    from urllib.parse import urlencode
 
-    base = str(request.base_url).rstrip("/")
-    redirect_url = f"{base}{settings.API_PREFIX}/auth/oauth-complete"
+class SignInRequest(_EmailBody):
+    password: _Password
 
-    # Use the frontend-supplied nonce (generated per-login-attempt).
-    # Fall back to a server-generated one if not provided.
-    used_nonce = nonce or secrets.token_hex(16)
-
-    # PKCE is required by newer Supabase to create a flow_state entry.
-    # Without code_challenge, Supabase won't store state → bad_oauth_state on callback.
-    # We store the verifier server-side so /callback can exchange the code.
-    #
-    # Do NOT pass a custom `state` — Supabase generates its own CSRF state.
-    # Overriding it causes bad_oauth_state. Nonce is embedded in redirect_to instead.
-    verifier, challenge = _generate_pkce_pair()
-    _store_pkce_verifier(used_nonce, verifier)
-    redirect_url_with_nonce = f"{redirect_url}?nonce={used_nonce}"
-    params: dict = {
-        "provider": "google",
-        "redirect_to": redirect_url_with_nonce,
-        "prompt": "select_account",
-        "code_challenge": challenge,
-        "code_challenge_method": "S256",
-    }
 
-    url = f"{settings.SUPABASE_URL}/auth/v1/authorize?" + urlencode(params)
-    return {"url": url}
-
-
-@router.get("/oauth-complete", response_class=HTMLResponse)
-async def oauth_complete():
-    """
-    Callback page after Google OAuth completes (both PKCE and implicit flows).
-
-    PKCE flow (modern, default):
-      Supabase redirects here with ?code=AUTH_CODE&state=NONCE in the query string.
-      This page sends {type, code, nonce} back to the opener via postMessage.
-      The frontend then calls /auth/callback with the code + nonce.
-      The backend looks up the stored code_verifier and exchanges the code for tokens.
-
-    Implicit flow (legacy fallback):
-      Supabase redirects here with #access_token=TOKEN&state=NONCE in the hash.
-      This page sends {type, access_token, refresh_token, nonce} to the opener.
-    """
-    return HTMLResponse(
-      content="""<!DOCTYPE html>
+# Static page served by /oauth-complete. Built (and gzipped) once at import
+# time — it has no per-request inputs, so there is no reason to re-allocate
+# or re-compress it on every login.
+_OAUTH_COMPLETE_HTML: bytes = """<!DOCTYPE html>
 <html lang="en">
 <head>
 <meta charset="utf-8">
@@ -301,7 +415,7 @@ async def oauth_complete():
   }
 
   if (error) {
-    var desc = errorDesc ? decodeURIComponent(errorDesc.replace(/\+/g, " ")) : error;
+    var desc = errorDesc ? decodeURIComponent(errorDesc.replace(/\\+/g, " ")) : error;
     showError(desc);
 
   } else if (code) {
@@ -362,34 +476,100 @@ async def oauth_complete():
 })();
 </script>
 </body>
-</html>""",
-      headers={
-          "Content-Security-Policy": (
-              "default-src 'none'; "
-              "script-src 'unsafe-inline'; "
-              "style-src 'unsafe-inline'; "
-              "connect-src 'self'"
-          ),
-      },
-    )
+</html>""".encode("utf-8")
+
+_OAUTH_COMPLETE_HTML_GZ = gzip.compress(_OAUTH_COMPLETE_HTML, compresslevel=9, mtime=0)
+
+_OAUTH_COMPLETE_HEADERS = {
+    "Content-Security-Policy": (
+        "default-src 'none'; "
+        "script-src 'unsafe-inline'; "
+        "style-src 'unsafe-inline'; "
+        "connect-src 'self'"
+    ),
+    # The page is fully static, so browsers/proxies may reuse it across popups.
+    "Cache-Control": "public, max-age=86400, immutable",
+    "Vary": "Accept-Encoding",
+}
+_OAUTH_COMPLETE_GZ_HEADERS = {**_OAUTH_COMPLETE_HEADERS, "Content-Encoding": "gzip"}
+
+
+@router.get("/login")
+async def login(request: Request, nonce: str = ""):
+    """
+    Return the Supabase OAuth URL for Google login using PKCE flow.
+
+    PKCE (Proof Key for Code Exchange) is the modern, secure OAuth flow:
+    1. We generate a code_verifier (random secret) + code_challenge (SHA-256 hash).
+    2. The code_challenge is sent to Supabase in the auth URL.
+    3. After login, Supabase redirects to /oauth-complete with ?code=AUTH_CODE.
+    4. The page sends code + nonce back to the opener via postMessage.
+    5. The frontend calls /auth/callback with code + nonce.
+    6. We look up the stored verifier by nonce and exchange the code for tokens.
+
+    The nonce ties the postMessage back to the original request (CSRF protection).
+    The code_verifier is stored server-side keyed by nonce (5-min TTL).
+    """
+    base = str(request.base_url).rstrip("/")
+
+    # Use the frontend-supplied nonce (generated per-login-attempt).
+    # Fall back to a server-generated one if not provided.
+    used_nonce = nonce or secrets.token_hex(16)
+
+    # PKCE is required by newer Supabase to create a flow_state entry.
+    # Without code_challenge, Supabase won't store state → bad_oauth_state on callback.
+    # We store the verifier server-side so /callback can exchange the code.
+    #
+    # Do NOT pass a custom `state` — Supabase generates its own CSRF state.
+    # Overriding it causes bad_oauth_state. Nonce is embedded in redirect_to instead.
+    verifier, challenge = _generate_pkce_pair()
+    _store_pkce_verifier(used_nonce, verifier)
+    redirect_to = quote(f"{base}{_OAUTH_REDIRECT_PATH}{used_nonce}", safe="")
+    return {"url": f"{_AUTHORIZE_URL_PREFIX}&code_challenge={challenge}&redirect_to={redirect_to}"}
+
+
+@router.api_route("/oauth-complete", methods=["GET", "HEAD"], response_class=HTMLResponse)
+async def oauth_complete(request: Request):
+    """
+    Callback page after Google OAuth completes (both PKCE and implicit flows).
+
+    PKCE flow (modern, default):
+      Supabase redirects here with ?code=AUTH_CODE&state=NONCE in the query string.
+      This page sends {type, code, nonce} back to the opener via postMessage.
+      The frontend then calls /auth/callback with the code + nonce.
+      The backend looks up the stored code_verifier and exchanges the code for tokens.
+
+    Implicit flow (legacy fallback):
+      Supabase redirects here with #access_token=TOKEN&state=NONCE in the hash.
+      This page sends {type, access_token, refresh_token, nonce} to the opener.
+    """
+    if request.method == "HEAD":
+        # Health checkers and link prefetchers only need the headers
+        return HTMLResponse(content=b"", headers=_OAUTH_COMPLETE_HEADERS)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return HTMLResponse(content=_OAUTH_COMPLETE_HTML_GZ, headers=_OAUTH_COMPLETE_GZ_HEADERS)
+    return HTMLResponse(content=_OAUTH_COMPLETE_HTML, headers=_OAUTH_COMPLETE_HEADERS)
 
 
 @router.post("/signup")
-async def signup(body: SignUpRequest, request: Request):
+async def signup(
+    body: SignUpRequest,
+    request: Request,
+    client: Client = Depends(get_supabase_anon),
+):
     """
     Sign up with email and password.
     Creates a new user in Supabase Auth.
     """
     _check_auth_rate_limit(request, "signup")
-    client = get_supabase_anon()
 
     try:
-        response = client.auth.sign_up({
+        response = await _run_blocking(client.auth.sign_up, {
             "email": body.email,
             "password": body.password,
             "options": {
                 "data": {
-                    "name": body.name or body.email.split("@")[0],
+                    "name": body.name or body.email_local,
                 }
             }
         })
@@ -397,18 +577,8 @@ async def signup(body: SignUpRequest, request: Request):
         if not response.user:
             raise HTTPException(status_code=400, detail="Failed to create account")
 
-        # Create user in our users table
-        sb = get_supabase()
-        try:
-            sb.table("users").insert({
-                "id": response.user.id,
-                "email": response.user.email or body.email,
-                "name": body.name or body.email.split("@")[0],
-                "tier": "free",
-            }).execute()
-        except Exception as insert_err:
-            # Log non-fatal insert errors — user exists in Auth but not in users table
-            logger.warning(f"users table insert after signup failed (user may already exist): {insert_err}")
+        # The users-table row is created by the on_auth_user_created trigger
+        # (migrations/004). If it's missing, get_current_user creates it on first use.
 
         return {
             "message": "Account created. Please check your email to verify.",
@@ -418,24 +588,28 @@ async def signup(body: SignUpRequest, request: Request):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Signup error: {e}")
-        error_msg = str(e).lower()
-        if "already registered" in error_msg:
+        logger.error("Signup error: %s", e)
+        code = getattr(e, "code", None)
+        if code in ("user_already_exists", "email_exists") or "already registered" in str(e).lower():
             raise HTTPException(status_code=400, detail="Email already registered. Please sign in.")
         raise HTTPException(status_code=400, detail="Sign up failed. Please try again.")
 
 
 @router.post("/signin")
-async def signin(body: SignInRequest, request: Request):
+async def signin(
+    body: SignInRequest,
+    request: Request,
+    background: BackgroundTasks,
+    client: Client = Depends(get_supabase_anon),
+):
     """
     Sign in with email and password.
     Returns access and refresh tokens.
     """
     _check_auth_rate_limit(request, "signin")
-    client = get_supabase_anon()
 
     try:
-        response = client.auth.sign_in_with_password({
+        response = await _run_blocking(client.auth.sign_in_with_password, {
             "email": body.email,
             "password": body.password,
         })
@@ -444,21 +618,15 @@ async def signin(body: SignInRequest, request: Request):
             raise HTTPException(status_code=401, detail="Invalid email or password")
 
         # Ensure user exists in our users table
-        sb = get_supabase()
         user = response.user
         user_meta = user.user_metadata or {}
 
-        existing = sb.table("users").select("*").eq("id", user.id).execute()
-
-        if existing.data:
-            user_record = existing.data[0]
-        else:
-            user_record = sb.table("users").insert({
-                "id": user.id,
-                "email": user.email or body.email,
-                "name": user_meta.get("name", body.email.split("@")[0]),
-                "tier": "free",
-            }).execute().data[0]
+        user_record = await _user_record_for({
+            "id": user.id,
+            "email": user.email or body.email,
+            "name": user_meta.get("name", body.email_local),
+            "tier": "free",
+        }, background)
 
         return {
             "user": user_record,
@@ -470,19 +638,27 @@ async def signin(body: SignInRequest, request: Request):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Signin error: {e}")
+        logger.error("Signin error: %s", e)
+        # Prefer GoTrue's error code; message matching covers errors raised
+        # before the API responded and older servers without codes.
+        code = getattr(e, "code", None)
         error_msg = str(e).lower()
-        if "invalid" in error_msg or "credentials" in error_msg:
+        if code == "invalid_credentials" or "invalid" in error_msg or "credentials" in error_msg:
             raise HTTPException(status_code=401, detail="Invalid email or password")
-        if "email not confirmed" in error_msg or "not confirmed" in error_msg:
+        if code == "email_not_confirmed" or "not confirmed" in error_msg:
             raise HTTPException(status_code=401, detail="Please verify your email before signing in. Check your inbox for the confirmation link.")
-        if "user not found" in error_msg or "no user" in error_msg:
+        if code == "user_not_found" or "user not found" in error_msg or "no user" in error_msg:
             raise HTTPException(status_code=401, detail="No account found with this email. Please sign up first.")
         raise HTTPException(status_code=401, detail="Sign in failed. Please try again.")
 
 
 @router.post("/callback")
-async def callback(body: TokenRequest, request: Request):
+async def callback(
+    body: TokenRequest,
+    request: Request,
+    background: BackgroundTasks,
+    client: Client = Depends(get_supabase_anon),
+):
     """
     Exchange OAuth tokens after Google login.
 
@@ -495,7 +671,6 @@ async def callback(body: TokenRequest, request: Request):
     Returns user info + fresh access/refresh tokens.
     """
     _check_auth_rate_limit(request, "callback")
-    client = get_supabase_anon()
 
     try:
         if body.code and body.nonce:
@@ -506,7 +681,7 @@ async def callback(body: TokenRequest, request: Request):
                     status_code=401,
                     detail="OAuth session expired or invalid. Please try signing in again."
                 )
-            auth_response = client.auth.exchange_code_for_session({
+            auth_response = await _run_blocking(client.auth.exchange_code_for_session, {
                 "auth_code": body.code,
                 "code_verifier": verifier,
             })
@@ -515,7 +690,9 @@ async def callback(body: TokenRequest, request: Request):
 
         elif body.access_token:
             # Implicit flow fallback
-            auth_response = client.auth.set_session(body.access_token, body.refresh_token)
+            auth_response = await _run_blocking(
+                client.auth.set_session, body.access_token, body.refresh_token
+            )
             user = auth_response.user
             session_obj = auth_response.session
 
@@ -529,22 +706,16 @@ async def callback(body: TokenRequest, request: Request):
             raise HTTPException(status_code=401, detail="Invalid tokens")
 
         # Ensure user exists in our users table
-        sb = get_supabase()
         user_meta = user.user_metadata or {}
 
-        existing = sb.table("users").select("*").eq("id", user.id).execute()
-
-        if existing.data:
-            user_record = existing.data[0]
-        else:
-            user_record = sb.table("users").insert({
-                "id": user.id,
-                "email": user.email or "",
-                "name": user_meta.get("full_name", user_meta.get("name", "")),
-                "google_id": str(user_meta.get("provider_id", user_meta.get("sub", user.id))),
-                "avatar_url": user_meta.get("avatar_url", user_meta.get("picture")),
-                "tier": "free",
-            }).execute().data[0]
+        user_record = await _user_record_for({
+            "id": user.id,
+            "email": user.email or "",
+            "name": user_meta.get("full_name", user_meta.get("name", "")),
+            "google_id": str(user_meta.get("provider_id", user_meta.get("sub", user.id))),
+            "avatar_url": user_meta.get("avatar_url", user_meta.get("picture")),
+            "tier": "free",
+        }, background)
 
         token_data = {
             "user": user_record,
@@ -562,7 +733,7 @@ async def callback(body: TokenRequest, request: Request):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"OAuth callback error: {e}")
+        logger.error("OAuth callback error: %s", e)
         raise HTTPException(status_code=401, detail="Authentication failed. Please try again.")
 
 
@@ -587,13 +758,16 @@ async def poll_token(nonce: str, request: Request):
 
 
 @router.post("/refresh")
-async def refresh(body: RefreshRequest, request: Request):
+async def refresh(
+    body: RefreshRequest,
+    request: Request,
+    client: Client = Depends(get_supabase_anon),
+):
     """Refresh an expired access token using the refresh token."""
     _check_auth_rate_limit(request, "refresh")
-    client = get_supabase_anon()
 
     try:
-        session = client.auth.refresh_session(body.refresh_token)
+        session = await _refresh_session_coalesced(client, body.refresh_token)
 
         if not session or not session.session:
             raise HTTPException(status_code=401, detail="Invalid refresh token")
@@ -606,7 +780,7 @@ async def refresh(body: RefreshRequest, request: Request):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Token refresh error: {e}")
+        logger.error("Token refresh error: %s", e)
         raise HTTPException(status_code=401, detail="Session expired. Please sign in again.")
 
 
@@ -621,8 +795,8 @@ async def logout(user: dict = Depends(get_current_user)):
     """Sign out the current user — invalidates the refresh token on Supabase side."""
     try:
         client = get_supabase_anon()
-        client.auth.sign_out()
+        await _run_blocking(client.auth.sign_out)
     except Exception as e:
         # Don't block logout if Supabase call fails — client will still clear tokens
-        logger.warning(f"Supabase sign_out failed (non-blocking): {e}")
+        logger.warning("Supabase sign_out failed (non-blocking): %s", e)
     return {"status": "logged_out"}
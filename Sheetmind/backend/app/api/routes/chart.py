@@ -1,5 +1,6 @@
 import json
 import logging
+from typing import ClassVar
 
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel, field_validator
@@ -21,8 +22,9 @@ class ChartRequest(BaseModel):
     chart_type: str | None = None
     title: str | None = None
 
-    MAX_TITLE_LENGTH: int = 500
-    MAX_DATA_BYTES: int = 5_000_000  # 5 MB
+    # --- Input size limits (ClassVar so Pydantic treats them as constants, not fields) ---
+    MAX_TITLE_LENGTH: ClassVar[int] = 500
+    MAX_DATA_BYTES: ClassVar[int] = 5_000_000  # 5 MB
 
     @field_validator("title")
     @classmethod
@@ -88,8 +90,10 @@ async def generate_chart_endpoint(
         prompt=cache_prompt,
         data=request.data,
     )
+    # Plain dicts: response_model validates them once on the way out, so
+    # building a ChartResponse here would validate the chart config twice.
     if cached:
-        return ChartResponse(**cached)
+        return cached
 
     chart_config = generate_chart(
         data=request.data,
@@ -120,4 +124,4 @@ async def generate_chart_endpoint(
         response=response_data,
     )
 
-    return ChartResponse(**response_data)
+    return response_data
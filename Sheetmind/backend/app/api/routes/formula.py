@@ -1,4 +1,6 @@
+import asyncio
 import logging
+from functools import partial
 
 from fastapi import APIRouter, HTTPException, Depends, Query
 from pydantic import BaseModel, field_validator
@@ -9,7 +11,9 @@ from app.services.confidence import calculate_confidence
 from app.services.source_linker import extract_sources
 from app.services.usage import check_and_increment
 from app.services.rate_limiter import check_rate_limit
-from app.services.cache import get_cached, set_cached
+from app.services.cache import (
+    get_cached, set_cached, get_cached_semantic, set_cached_semantic, set_cached_in_background,
+)
 from app.services.profiler import StepTimer
 from app.services.formula_validator import validate_formula
 
@@ -122,7 +126,7 @@ async def execute_formula(
     profile: bool = Query(False),
 ):
     """Process a =SHEETMIND() cell formula request."""
-    timer = StepTimer()
+    timer = StepTimer(enabled=profile)
 
     timer.start("rate_limit")
     _check_limits(user, "formula_count")
@@ -130,12 +134,14 @@ async def execute_formula(
     user_id = user["id"]
 
     timer.start("cache_lookup")
-    cached = get_cached(
+    loop = asyncio.get_running_loop()
+    cached = await loop.run_in_executor(None, partial(
+        get_cached_semantic,
         user_id=user_id,
         endpoint="formula_execute",
         prompt=request.prompt,
         data=request.range_data,
-    )
+    ))
     timer.stop("cache_lookup")
 
     if cached:
@@ -153,21 +159,22 @@ async def execute_formula(
             raise HTTPException(status_code=503, detail="AI service temporarily unavailable. Please try again.")
         timer.stop("ai_call")
 
-        timer.start("confidence")
+        # Scoring and source extraction only read the result; run them
+        # together off the event loop.
+        timer.start("confidence_sources")
         sheet_data = None
         if request.range_data:
             sheet_data = {"rows": request.range_data}
-        conf = calculate_confidence(
-            message=request.prompt,
-            response=result,
-            sheet_data=sheet_data,
+        conf, sources_json = await asyncio.gather(
+            loop.run_in_executor(None, partial(
+                calculate_confidence,
+                message=request.prompt,
+                response=result,
+                sheet_data=sheet_data,
+            )),
+            loop.run_in_executor(None, extract_sources, result),
         )
-        timer.stop("confidence")
-
-        timer.start("source_extraction")
-        sources = extract_sources(result)
-        sources_json = [s.model_dump() for s in sources]
-        timer.stop("source_extraction")
+        timer.stop("confidence_sources")
 
         response_data = {
             "result": result,
@@ -176,15 +183,15 @@ async def execute_formula(
             "sources": sources_json,
         }
 
-        timer.start("cache_set")
-        set_cached(
+        # Fire-and-forget: the semantic tier embeds the prompt before storing
+        set_cached_in_background(
+            set_cached_semantic,
             user_id=user_id,
             endpoint="formula_execute",
             prompt=request.prompt,
             data=request.range_data,
-            response=response_data,
+            response=dict(response_data),
         )
-        timer.stop("cache_set")
 
     profile_data = timer.log("formula_execute")
     if profile:
@@ -199,7 +206,7 @@ async def explain_formula_endpoint(
     profile: bool = Query(False),
 ):
     """Explain an existing spreadsheet formula in plain English."""
-    timer = StepTimer()
+    timer = StepTimer(enabled=profile)
 
     timer.start("rate_limit")
     _check_limits(user, "query_count")
@@ -276,14 +283,14 @@ async def explain_formula_endpoint(
         }
     timer.stop("confidence")
 
-    timer.start("cache_set")
-    set_cached(
+    # Fire-and-forget: the response doesn't wait on the Redis write
+    set_cached_in_background(
+        set_cached,
         user_id=user_id,
         endpoint=cache_endpoint,
         prompt=request.formula,
-        response=response_data,
+        response=dict(response_data),
     )
-    timer.stop("cache_set")
 
     profile_data = timer.log("formula_explain")
     if profile:
@@ -298,7 +305,7 @@ async def fix_formula_endpoint(
     profile: bool = Query(False),
 ):
     """Fix a broken spreadsheet formula."""
-    timer = StepTimer()
+    timer = StepTimer(enabled=profile)
 
     timer.start("rate_limit")
     _check_limits(user, "query_count")
@@ -361,15 +368,15 @@ async def fix_formula_endpoint(
         "confidence_tier": conf["tier"],
     }
 
-    timer.start("cache_set")
-    set_cached(
+    # Fire-and-forget: the response doesn't wait on the Redis write
+    set_cached_in_background(
+        set_cached,
         user_id=user_id,
         endpoint="formula_fix",
         prompt=cache_prompt,
         data=request.sheet_context,
-        response=response_data,
+        response=dict(response_data),
     )
-    timer.stop("cache_set")
 
     profile_data = timer.log("formula_fix")
     if profile:
@@ -2,7 +2,7 @@ import asyncio
 import logging
 import time
 
-from fastapi import APIRouter, Header
+from fastapi import APIRouter, Header, Request
 from fastapi.responses import JSONResponse
 from typing import Optional
 
@@ -43,12 +43,30 @@ def _check_redis() -> str:
     return "unavailable"
 
 
+def _pool_backlog(request: Request) -> dict:
+    """Tasks waiting for a thread in each worker pool (0 = no queueing)."""
+    pools = {"io": getattr(request.app.state, "io_executor", None)}
+    try:
+        from app.api.routes.chat import _bg_executor, _cpu_executor
+        pools["llm"] = _bg_executor
+        pools["cpu"] = _cpu_executor
+    except ImportError:
+        pass
+    try:
+        from app.services.rag_system import _rag_executor
+        pools["rag"] = _rag_executor
+    except ImportError:
+        pass
+    return {name: pool._work_queue.qsize() for name, pool in pools.items() if pool is not None}
+
+
 @router.api_route("/health/db", methods=["GET", "HEAD"])
-async def health_check_db(x_health_key: Optional[str] = Header(default=None)):
+async def health_check_db(request: Request, x_health_key: Optional[str] = Header(default=None)):
     """Check Supabase and Redis connectivity. Returns 503 if any critical service is down.
 
     In production, requires X-Health-Key header matching HEALTH_CHECK_KEY env var.
-    Without the key, returns only status (no internal details).
+    Without the key, returns only status (no internal details). Authorized
+    callers also get the number of tasks queued on each thread pool.
     """
     is_prod = settings.APP_ENV == "production"
     health_key = getattr(settings, "HEALTH_CHECK_KEY", "")
@@ -101,5 +119,6 @@ async def health_check_db(x_health_key: Optional[str] = Header(default=None)):
     if authorized:
         content["checks"] = checks
         content["elapsed_ms"] = elapsed_ms
+        content["pool_backlog"] = _pool_backlog(request)
 
     return JSONResponse(status_code=status_code, content=content)
@@ -41,6 +41,7 @@ class Settings(BaseSettings):
     # Google Gemini API (direct, no proxy)
     GEMINI_API_KEY: str = ""
     GEMINI_ENABLED: bool = False  # Set True when Gemini key has quota
+    LLM_HEDGE_DELAY: float = 8.0  # seconds without a first chunk before the next fallback model is raced (0 = strictly one at a time)
 
     # LangChain Agent Settings
     LANGCHAIN_ENABLED: bool = True  # Enable LangChain ReAct agent
@@ -50,6 +51,12 @@ class Settings(BaseSettings):
     CHROMA_PERSIST_DIR: str = "./chroma_db"  # Vector DB storage path
     RAG_THRESHOLD_ROWS: int = 500  # Activate RAG above this row count
     RAG_RESULTS_COUNT: int = 30  # Number of rows to retrieve via RAG
+    RAG_THREAD_POOL_SIZE: int = 4  # threads per worker for Chroma reads/writes
+    RAG_ROW_VECTOR_CACHE_SIZE: int = 10_000  # row embeddings kept per worker for re-indexing
+
+    # Semantic response cache — reuse answers for reworded prompts
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_THRESHOLD: float = 0.92  # min cosine similarity for a hit
 
     # Memory Configuration
     MEMORY_WINDOW_SIZE: int = 10  # Number of conversation turns to remember
@@ -1,34 +1,116 @@
-from supabase import create_client, Client
+import httpx
+from supabase import create_client, Client, ClientOptions
 
 from app.core.config import settings
 
 # Service role client — bypasses RLS, used for backend operations
 _supabase_client: Client | None = None
+_supabase_http: httpx.Client | None = None
 
 # Anon-key client — used for auth operations (token validation, sign-up, sign-in)
 _anon_client: Client | None = None
+_anon_http: httpx.Client | None = None
+
+# Async PostgREST client (service role) for hot-path writes
+_postgrest_async: httpx.AsyncClient | None = None
 
 
 def get_supabase() -> Client:
-    """Get the Supabase client (service role). Lazily initialized."""
-    global _supabase_client
+    """Get the Supabase client (service role). Lazily initialized.
+
+    Every caller (route handlers, services, worker threads) shares one
+    client and one keep-alive httpx pool, sized so each blocking-I/O
+    thread can hold a connection without waiting on the pool.
+    """
+    global _supabase_client, _supabase_http
     if _supabase_client is None:
+        _supabase_http = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=settings.THREAD_POOL_SIZE * 2,
+                max_keepalive_connections=settings.THREAD_POOL_SIZE,
+                keepalive_expiry=30,
+            ),
+            timeout=httpx.Timeout(30.0),
+        )
         _supabase_client = create_client(
             settings.SUPABASE_URL,
             settings.SUPABASE_SERVICE_ROLE_KEY,
+            options=ClientOptions(httpx_client=_supabase_http),
         )
     return _supabase_client
 
 
+def close_supabase() -> None:
+    """Close the service-role client's HTTP pool (called on app shutdown)."""
+    global _supabase_client, _supabase_http
+    if _supabase_http is not None:
+        _supabase_http.close()
+    _supabase_client = None
+    _supabase_http = None
+
+
 def get_supabase_anon() -> Client:
     """Get the Supabase client (anon key, for auth). Lazily initialized.
 
     Shared singleton to avoid creating a new HTTP pool on every request.
+    Auth and PostgREST calls go through one keep-alive httpx pool, so
+    TCP/TLS handshakes are paid once per connection instead of per call.
+    Usable directly or as a FastAPI dependency (``Depends(get_supabase_anon)``).
     """
-    global _anon_client
+    global _anon_client, _anon_http
     if _anon_client is None:
+        _anon_http = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=20,
+                max_keepalive_connections=10,
+                keepalive_expiry=30,
+            ),
+            timeout=httpx.Timeout(10.0),
+        )
         _anon_client = create_client(
             settings.SUPABASE_URL,
             settings.SUPABASE_ANON_KEY,
+            options=ClientOptions(httpx_client=_anon_http),
         )
     return _anon_client
+
+
+def close_supabase_anon() -> None:
+    """Close the anon client's HTTP pool (called on app shutdown)."""
+    global _anon_client, _anon_http
+    if _anon_http is not None:
+        _anon_http.close()
+    _anon_client = None
+    _anon_http = None
+
+
+def get_postgrest_async() -> httpx.AsyncClient:
+    """Get an async httpx client for PostgREST (service role). Lazily initialized.
+
+    supabase-py's sync client has to run in a thread pool; writes fired from
+    request handlers (e.g. the persist_chat RPC) await this client instead,
+    so they don't hold a pool thread for the whole network round-trip.
+    Paths are relative to /rest/v1, e.g. ``post("/rpc/persist_chat", ...)``.
+    """
+    global _postgrest_async
+    if _postgrest_async is None:
+        key = settings.SUPABASE_SERVICE_ROLE_KEY
+        _postgrest_async = httpx.AsyncClient(
+            base_url=f"{settings.SUPABASE_URL.rstrip('/')}/rest/v1",
+            headers={"apikey": key, "Authorization": f"Bearer {key}"},
+            limits=httpx.Limits(
+                max_connections=20,
+                max_keepalive_connections=10,
+                keepalive_expiry=30,
+            ),
+            timeout=httpx.Timeout(10.0),
+        )
+    return _postgrest_async
+
+
+async def close_postgrest_async() -> None:
+    """Close the async PostgREST client (called on app shutdown)."""
+    global _postgrest_async
+    if _postgrest_async is not None:
+        await _postgrest_async.aclose()
+    _postgrest_async = None
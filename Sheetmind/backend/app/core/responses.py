@@ -0,0 +1,21 @@
+"""
+Response classes shared by API routers.
+"""
+
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson.
+
+    orjson serializes dicts several times faster than the stdlib encoder and
+    writes bytes directly, skipping the str -> bytes encode step.
+    Defined here rather than imported from fastapi.responses, where the
+    equivalent class is deprecated in newer FastAPI releases.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
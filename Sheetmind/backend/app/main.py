@@ -5,10 +5,12 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
 from api_analytics.fastapi import Analytics
 
 from app.core.config import settings
+from app.core.responses import ORJSONResponse
 from app.api.router import api_router
 
 # Configure logging to show INFO level
@@ -32,6 +34,7 @@ async def lifespan(app: FastAPI):
         thread_name_prefix="sheetmind-io",
     )
     loop.set_default_executor(default_executor)
+    app.state.io_executor = default_executor
     logger.info(f"Default thread pool: {settings.THREAD_POOL_SIZE} workers")
 
     # Warm Supabase connection + HTTP pool across key tables
@@ -51,13 +54,36 @@ async def lifespan(app: FastAPI):
     except Exception:
         pass
 
+    # Batch chat persistence through one background worker
+    from app.api.routes.chat import persist_queued_chat
+    from app.services.persist_queue import start_persist_worker, stop_persist_worker
+    start_persist_worker(persist_queued_chat)
+
     yield
 
+    # Flush queued chat writes before the HTTP pools below are closed
+    await stop_persist_worker()
+
     # Shutdown: clean up thread pools
     default_executor.shutdown(wait=False)
     try:
-        from app.api.routes.chat import _bg_executor
+        from app.api.routes.chat import _bg_executor, _cpu_executor
         _bg_executor.shutdown(wait=False)
+        _cpu_executor.shutdown(wait=False)
+    except Exception:
+        pass
+    try:
+        from app.services.rag_system import _rag_executor
+        _rag_executor.shutdown(wait=False)
+    except Exception:
+        pass
+
+    # Close the pooled HTTP connections held by the Supabase and PostgREST clients
+    try:
+        from app.core.database import close_supabase, close_supabase_anon, close_postgrest_async
+        close_supabase()
+        close_supabase_anon()
+        await close_postgrest_async()
     except Exception:
         pass
 
@@ -69,6 +95,7 @@ app = FastAPI(
     description="AI-powered Google Sheets & Excel add-on with confidence scores and source linking",
     version="0.1.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     # Disable interactive API docs in production — they expose all endpoints
     # and request schemas publicly. Enable locally via APP_ENV=development.
     docs_url=None if _is_prod else "/docs",
@@ -87,6 +114,11 @@ app.add_middleware(
     allow_headers=["Authorization", "Content-Type"],
 )
 
+# Compress large JSON bodies (chat answers with steps/sources, RAG hits).
+# Small responses skip it; Starlette never buffers text/event-stream, so
+# /chat/stream tokens still flush immediately.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=6)
+
 # Security headers middleware — hardens responses against common attacks
 class SecurityHeadersMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
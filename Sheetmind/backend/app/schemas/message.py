@@ -1,18 +1,32 @@
-import json
 import uuid
 from datetime import datetime
 from enum import Enum
-from typing import ClassVar, Optional
+from typing import Annotated, ClassVar, Literal, Optional
 
-from pydantic import BaseModel, field_validator
+import orjson
+from pydantic import BaseModel, Field, StringConstraints, field_validator, model_validator
+from typing_extensions import TypedDict  # pydantic needs this one before Python 3.12
 
 
+# Non-negative counts, row numbers and step numbers. Strict: every producer
+# is backend code that passes real ints, so no str/float/bool coercion.
+Count = Annotated[int, Field(ge=0, strict=True)]
+
+
+# MessageRole and ChatMode name the values for route code; the models declare
+# the fields as Literal, which pydantic-core checks as a plain string-set
+# lookup instead of going through the Enum validator.
+
 class MessageRole(str, Enum):
     user = "user"
     assistant = "assistant"
 
 
-class SourceReference(BaseModel):
+# Response-only shapes are TypedDicts: routes build them as plain dicts that
+# go straight into the JSON response, with no model instance per item to
+# construct, validate and dump again. They still document ChatResponse.
+
+class SourceReference(TypedDict):
     label: str        # e.g. "Rows 45-67"
     sheet: str        # e.g. "Sheet1"
     range: str        # e.g. "A45:A67"
@@ -27,9 +41,9 @@ class ColumnMetadata(BaseModel):
     letter: str
     header: str
     type: str  # "numeric", "text", "date", "categorical", "empty"
-    uniqueCount: int = 0
-    nullCount: int = 0
-    samples: list[str] = []
+    uniqueCount: Count = 0
+    nullCount: Count = 0
+    samples: list[str] = Field(default_factory=list)
 
     # Numeric stats (only for numeric columns)
     min: Optional[float] = None
@@ -38,31 +52,31 @@ class ColumnMetadata(BaseModel):
     sum: Optional[float] = None
 
     # Categorical stats (only for categorical columns)
-    categories: list[str] = []
+    categories: list[str] = Field(default_factory=list)
 
 
 class SheetMetadata(BaseModel):
     """Complete metadata for a spreadsheet, used by the pre-processing layer."""
     sheetName: str
-    totalRows: int
-    dataRows: int  # Excluding header
-    lastRow: int
-    totalColumns: int
-    columns: list[ColumnMetadata] = []
-    suggestedGroupBy: list[str] = []  # Column letters good for grouping
-    suggestedAggregate: list[str] = []  # Column letters good for SUM/AVG
+    totalRows: Count
+    dataRows: Count  # Excluding header
+    lastRow: Count
+    totalColumns: Count
+    columns: list[ColumnMetadata] = Field(default_factory=list)
+    suggestedGroupBy: list[str] = Field(default_factory=list)  # Column letters good for grouping
+    suggestedAggregate: list[str] = Field(default_factory=list)  # Column letters good for SUM/AVG
     suggestedDateColumn: Optional[str] = None
 
 
-class StepAction(BaseModel):
-    step: int
+class StepAction(TypedDict):
+    step: Count
     description: str
     action: dict
-    formula: str | None = None
-    about: str | None = None
+    formula: str | None
+    about: str | None
 
 
-class QuickAction(BaseModel):
+class QuickAction(TypedDict):
     label: str
     prompt: str
 
@@ -76,26 +90,26 @@ class HistoryMessage(BaseModel):
 # LangChain Agent Models
 # ---------------------------------------------------------------------------
 
-class AgentReasoningStep(BaseModel):
+class AgentReasoningStep(TypedDict):
     """A single reasoning step from the LangChain ReAct agent."""
-    step: int
+    step: Count
     thought: str
     tool: str
     tool_input: str
     result: str
 
 
-class ClarificationOption(BaseModel):
+class ClarificationOption(TypedDict):
     """A single clickable option for clarification."""
     label: str          # e.g. "A: Name"
     value: str          # sent as message on click, e.g. "Column A (Name)"
     description: str    # e.g. "text, 30 rows"
 
 
-class Clarification(BaseModel):
+class Clarification(TypedDict):
     """Clickable clarification cards sent with an AI question."""
     question: str       # The AI's question text
-    type: str           # "column" | "sheet" | "range" | "custom"
+    type: Literal["column", "sheet", "range", "custom"]
     options: list[ClarificationOption]
 
 
@@ -108,19 +122,19 @@ class ClearMemoryRequest(BaseModel):
 # RAG Models
 # ---------------------------------------------------------------------------
 
-class RAGSearchResult(BaseModel):
+class RAGSearchResult(TypedDict):
     """A single result from RAG semantic search."""
-    row: int
+    row: Count
     content: str
     cells: dict
     score: float
-    sheet: str | None = None
+    sheet: str | None
 
 
 class RAGIndexResponse(BaseModel):
     """Response from RAG index endpoint."""
     status: str
-    indexed: int
+    indexed: Count
     collection: str | None = None
     embedding_type: str | None = None
     error: str | None = None
@@ -130,7 +144,7 @@ class RAGSearchResponse(BaseModel):
     """Response from RAG search endpoint."""
     query: str
     results: list[dict]
-    count: int
+    count: Count
 
 
 class ChatMode(str, Enum):
@@ -138,14 +152,22 @@ class ChatMode(str, Enum):
     chat = "chat"      # Just answers questions
 
 
+# A UUID kept in its (lower-cased) text form: routes only ever use the string,
+# so there is no point building a uuid.UUID and str()-ing it straight back.
+UUIDStr = Annotated[str, StringConstraints(
+    pattern=r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$",
+    to_lower=True,
+)]
+
+
 class ChatRequest(BaseModel):
-    conversation_id: uuid.UUID | None = None
+    conversation_id: UUIDStr | None = None
     message: str
     sheet_data: dict | None = None
     sheet_name: str | None = None
     force_refresh: bool = False
     history: list[HistoryMessage] | None = None
-    mode: ChatMode | None = None  # "action" = create sheets/formulas, "chat" = just answer
+    mode: Literal["action", "chat"] | None = None  # "action" = create sheets/formulas, "chat" = just answer
     sheets: list[str] | None = None  # List of sheet names from the frontend
 
     # --- Input size limits (ClassVar so Pydantic treats them as constants, not fields) ---
@@ -153,6 +175,12 @@ class ChatRequest(BaseModel):
     MAX_SHEET_CELLS: ClassVar[int] = 50_000
     MAX_SHEET_DATA_BYTES: ClassVar[int] = 5_000_000  # 5 MB
     MAX_HISTORY_LENGTH: ClassVar[int] = 50  # 25 exchanges
+    MAX_BODY_BYTES: ClassVar[int] = 10_000_000  # whole raw body: 2x the sheet limit, room for history
+
+    @classmethod
+    def from_request_bytes(cls, body: bytes) -> "ChatRequest":
+        """Validate a raw JSON request body in one pass (no json.loads first)."""
+        return cls.model_validate_json(body)
 
     @field_validator("message")
     @classmethod
@@ -163,19 +191,23 @@ class ChatRequest(BaseModel):
             )
         return v
 
-    @field_validator("history")
+    @field_validator("history", mode="before")
     @classmethod
-    def validate_history_length(cls, v: list | None) -> list | None:
-        if v is not None and len(v) > cls.MAX_HISTORY_LENGTH:
-            # Truncate to the most recent messages rather than rejecting
+    def validate_history_length(cls, v):
+        # Truncate to the most recent messages rather than rejecting. Runs on
+        # the raw list, so the messages being dropped are never validated.
+        if isinstance(v, list) and len(v) > cls.MAX_HISTORY_LENGTH:
             v = v[-cls.MAX_HISTORY_LENGTH:]
         return v
 
-    @field_validator("sheet_data")
+    @model_validator(mode="before")
     @classmethod
-    def validate_sheet_data_size(cls, v: dict | None) -> dict | None:
-        if v is None:
-            return v
+    def validate_sheet_data_size(cls, data):
+        # Runs on the raw payload, before pydantic validates the sheet_data
+        # field, so an oversized sheet is rejected without that pass over it.
+        v = data.get("sheet_data") if isinstance(data, dict) else None
+        if not isinstance(v, dict):
+            return data
         # Check cell count
         cells = v.get("cells")
         if isinstance(cells, dict) and len(cells) > cls.MAX_SHEET_CELLS:
@@ -183,17 +215,24 @@ class ChatRequest(BaseModel):
                 f"Sheet data too large ({len(cells)} cells). Maximum is {cls.MAX_SHEET_CELLS}."
             )
         # Check total payload byte size to prevent memory abuse
+        # (orjson: encodes straight to UTF-8 bytes, no intermediate str).
+        # Exact on purpose: bounding the size by summing str lengths in Python
+        # costs about as much as orjson encoding the whole payload.
         try:
-            byte_size = len(json.dumps(v))
-        except (TypeError, ValueError):
+            byte_size = len(orjson.dumps(v, option=orjson.OPT_NON_STR_KEYS))
+        except (TypeError, orjson.JSONEncodeError):
             byte_size = 0
         if byte_size > cls.MAX_SHEET_DATA_BYTES:
             mb = byte_size / 1_000_000
             raise ValueError(
                 f"Sheet data payload too large ({mb:.1f} MB). Maximum is {cls.MAX_SHEET_DATA_BYTES // 1_000_000} MB."
             )
-        return v
+        return data
+
 
+# ChatResponse and MessageResponse document response bodies only: the routes
+# build plain dicts that ORJSONResponse serializes, so no instance (and no
+# validation) is paid per request. Keep them in step with those dicts.
 
 class ChatResponse(BaseModel):
     conversation_id: uuid.UUID
@@ -222,7 +261,7 @@ class ChatResponse(BaseModel):
 
 class MessageResponse(BaseModel):
     id: uuid.UUID
-    role: MessageRole
+    role: Literal["user", "assistant"]
     content: str
     sources: list[SourceReference] | None
     created_at: datetime
@@ -1,7 +1,12 @@
-import json
 import logging
 import re
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import lru_cache, partial
 
+import orjson
 from openai import OpenAI
 
 from app.core.config import settings
@@ -211,6 +216,7 @@ RULES:
 8. For fillDown, the formula in the first cell should use relative references that adjust when copied down
 9. In the "summary" field, after describing what was done, add a line "What would you like to do next?" followed by 2-3 numbered suggestions for related follow-up actions
 10. NEVER use CONCAT() for concatenation — it only accepts exactly 2 arguments. Use the & operator instead: =D2 & " - " & B2. For joining with delimiters use TEXTJOIN(delimiter, ignore_empty, range).
+11. You have the spreadsheet data in the context. Plan directly from it — NEVER say you cannot access or view the data.
 
 EXAMPLE — "sum of values grouped by major":
 The source sheet has Major in column E (E2:E31) and Value in column G (G2:G31).
@@ -270,17 +276,34 @@ PRIMARY_MODEL = "gemini-2.0-flash"
 FALLBACK_MODEL = "google/gemini-2.0-flash-001"
 GPT_FALLBACK_MODEL = "openai/gpt-4o-mini"
 
-# Refusal detection patterns
-_REFUSAL_PATTERNS = re.compile(
-    r"I cannot|I'm not able to|I can't|I am not able to|I do not have access|"
-    r"I don't have access|I'm unable to|I am unable to|"
-    r"I cannot directly access|I can't directly access|"
-    r"I don't have the ability|I do not have the ability|"
-    r"as an AI|as a language model|I cannot browse|I cannot view",
-    re.IGNORECASE,
+# Refusal detection phrases, matched case-insensitively against the first
+# _REFUSAL_WINDOW chars. They are plain literals, so they go into one
+# Aho-Corasick automaton (a single pass over the lowercased text) rather
+# than a regex alternation; without pyahocorasick each is a substring test.
+_REFUSAL_WINDOW = 200
+_REFUSAL_PHRASES = (
+    "i cannot", "i'm not able to", "i can't", "i am not able to", "i do not have access",
+    "i don't have access", "i'm unable to", "i am unable to",
+    "i cannot directly access", "i can't directly access",
+    "i don't have the ability", "i do not have the ability",
+    "as an ai", "as a language model", "i cannot browse", "i cannot view",
 )
-
-
+try:
+    import ahocorasick as _ahocorasick
+except ImportError:
+    _REFUSAL_AC = None
+else:
+    _REFUSAL_AC = _ahocorasick.Automaton()
+    for _phrase in _REFUSAL_PHRASES:
+        _REFUSAL_AC.add_word(_phrase, _phrase)
+    _REFUSAL_AC.make_automaton()
+
+
+# The clients are built once and shared: each OpenAI() owns its own httpx
+# connection pool, so a client per call meant a fresh TCP+TLS handshake for
+# every request and every fallback hop. OpenAI clients are thread-safe.
+
+@lru_cache(maxsize=1)
 def _get_gemini_client() -> OpenAI:
     """Get an OpenAI-compatible client pointing to Google Gemini API."""
     return OpenAI(
@@ -289,6 +312,7 @@ def _get_gemini_client() -> OpenAI:
     )
 
 
+@lru_cache(maxsize=1)
 def _get_openrouter_client() -> OpenAI:
     """Get an OpenAI-compatible client pointing to OpenRouter (fallback)."""
     return OpenAI(
@@ -297,59 +321,72 @@ def _get_openrouter_client() -> OpenAI:
     )
 
 
-def _cells_to_table(cells: dict) -> str:
+_CELL_REF_RE = re.compile(r"^([A-Z]+)(\d+)$")
+_DIGITS = "0123456789"
+
+
+def _cells_to_table(cells: dict, max_chars: int | None = None) -> str:
     """Convert a cells map like {"A1": "Name", "B1": "Age", "A2": "Alice", "B2": "30"}
-    into a readable spreadsheet table format."""
+    into a readable spreadsheet table format.
 
-    # Parse cell references into (row, col_letter, col_index) -> value
-    cell_pattern = re.compile(r"^([A-Z]+)(\d+)$")
-    parsed = {}
+    With *max_chars*, rows stop being added once the table is longer than
+    that: the caller truncates to the same limit, so the rest would be cut.
+    """
+
+    # Parse cell references into row -> {col_letter: value}
+    rows = {}
     all_cols = set()
-    all_rows = set()
 
     for ref, val in cells.items():
-        m = cell_pattern.match(ref)
-        if not m:
-            continue
-        col_letter = m.group(1)
-        row_num = int(m.group(2))
-        parsed[(row_num, col_letter)] = val
+        # Fast path for the usual ASCII "AB12": split off the trailing digits
+        # with str methods; anything unusual goes through the regex instead.
+        col_letter = ref.rstrip(_DIGITS)
+        if col_letter and len(col_letter) < len(ref) and col_letter.isascii() \
+                and col_letter.isalpha() and col_letter.isupper():
+            row_num = int(ref[len(col_letter):])
+        else:
+            m = _CELL_REF_RE.match(ref)
+            if not m:
+                continue
+            col_letter = m.group(1)
+            row_num = int(m.group(2))
+        row = rows.get(row_num)
+        if row is None:
+            rows[row_num] = row = {}
+        row[col_letter] = val
         all_cols.add(col_letter)
-        all_rows.add(row_num)
 
-    if not parsed:
+    if not rows:
         return ""
 
     # Sort columns alphabetically (A, B, C, ... AA, AB)
     sorted_cols = sorted(all_cols, key=lambda c: (len(c), c))
-    sorted_rows = sorted(all_rows)
+    sorted_rows = sorted(rows)
+    first_row = sorted_rows[0]
 
     # Build table with | delimiters
-    lines = []
-
-    # Header row with column letters
-    header = "| Row |"
-    for col in sorted_cols:
-        header += f" {col} |"
-    lines.append(header)
-
-    sep = "|-----|" + "".join(["------|" for _ in sorted_cols])
-    lines.append(sep)
+    lines = [
+        # Header row with column letters
+        "| Row | " + " | ".join(sorted_cols) + " |",
+        "|-----|" + "------|" * len(sorted_cols),
+    ]
 
+    size = len(lines[0]) + len(lines[1]) + 1
     for row_num in sorted_rows:
-        label = f"{row_num} (header)" if row_num == sorted_rows[0] else str(row_num)
-        line = f"| {label} |"
-        for col in sorted_cols:
-            val = parsed.get((row_num, col), "")
-            val_str = str(val)[:30]
-            line += f" {val_str} |"
+        label = f"{row_num} (header)" if row_num == first_row else str(row_num)
+        get = rows[row_num].get
+        values = " | ".join([str(get(col, ""))[:30] for col in sorted_cols])
+        line = f"| {label} | {values} |"
         lines.append(line)
+        size += len(line) + 1
+        if max_chars is not None and size > max_chars:
+            return "\n".join(lines)
 
     # Show column-header mapping explicitly
-    first_row = sorted_rows[0]
+    header = rows[first_row]
     col_map = []
     for col in sorted_cols:
-        header_val = parsed.get((first_row, col), "")
+        header_val = header.get(col, "")
         if header_val:
             col_map.append(f"Column {col} = \"{header_val}\"")
     if col_map:
@@ -359,8 +396,16 @@ def _cells_to_table(cells: dict) -> str:
     return "\n".join(lines)
 
 
-def _build_context_message(sheet_data: dict | None, sheet_name: str | None) -> str:
-    """Build a context string from sheet data to include in the AI prompt."""
+def _build_context_message(
+    sheet_data: dict | None,
+    sheet_name: str | None,
+    max_chars: int | None = None,
+) -> str:
+    """Build a context string from sheet data to include in the AI prompt.
+
+    *max_chars* is the limit the caller truncates the result to; the sheet
+    table and legacy rows are only built far enough to fill it.
+    """
     if not sheet_data:
         return ""
 
@@ -373,25 +418,30 @@ def _build_context_message(sheet_data: dict | None, sheet_name: str | None) -> s
 
     # New format: cells map -> convert to readable table
     if "cells" in sheet_data and sheet_data["cells"]:
-        table = _cells_to_table(sheet_data["cells"])
+        table = _cells_to_table(sheet_data["cells"], max_chars)
         if table:
             parts.append(f"Spreadsheet data:\n{table}")
 
     # Legacy format: headers + rows
     if "headers" in sheet_data and "cells" not in sheet_data:
-        parts.append(f"Headers: {json.dumps(sheet_data['headers'])}")
+        parts.append(f"Headers: {orjson.dumps(sheet_data['headers']).decode()}")
 
     if "rows" in sheet_data and "cells" not in sheet_data:
         row_count = len(sheet_data["rows"])
         parts.append(f"Data ({row_count} rows):")
+        size = 0
         for i, row in enumerate(sheet_data["rows"]):
-            parts.append(f"  Row {i + 1}: {json.dumps(row)}")
+            line = f"  Row {i + 1}: {orjson.dumps(row).decode()}"
+            parts.append(line)
+            size += len(line) + 1
+            if max_chars is not None and size > max_chars:
+                break
 
     if "selectedRange" in sheet_data and sheet_data["selectedRange"]:
         parts.append(f"Currently selected: {sheet_data['selectedRange']}")
 
     if "values" in sheet_data:
-        parts.append(f"Cell values: {json.dumps(sheet_data['values'])}")
+        parts.append(f"Cell values: {orjson.dumps(sheet_data['values']).decode()}")
 
     return "\n".join(parts)
 
@@ -428,28 +478,34 @@ def _enrich_short_message(user_message: str, history: list[dict] | None) -> str:
     return "\n".join(parts)
 
 
-def _call_model(
-    model: str,
+def _build_messages(
     system_prompt: str,
     user_message: str,
     context: str,
-    client: OpenAI | None = None,
     history: list[dict] | None = None,
-) -> str:
-    """Call a model and return the response text.
-
-    Phase 1A fix: merge context + question into ONE user message so Gemini
-    does not get confused by two consecutive user messages.
-    Phase 3: insert conversation history between system and current message.
+) -> list[dict]:
+    """Build the chat messages list sent to the model.
+
+    Ordered from most to least stable so provider prompt caching (automatic
+    prefix caching on OpenAI/Gemini) can reuse as much as possible:
+    static system prompt → sheet data → history → current message. The
+    system prompts are module constants and must stay free of per-request
+    values (timestamps, ids, sheet data).
+
+    Phase 1A fix: sheet data goes in its own system message rather than a
+    separate user message, so Gemini never sees two consecutive user turns.
+    Phase 3: insert conversation history before the current message.
     """
-    if client is None:
-        client = _get_gemini_client()
-
     # Enrich short follow-ups with explicit context from last exchange
     user_message = _enrich_short_message(user_message, history)
 
     messages = [{"role": "system", "content": system_prompt}]
 
+    # Sheet data rarely changes between turns of a conversation; keeping it
+    # ahead of the history lets the cached prefix cover it too
+    if context:
+        messages.append({"role": "system", "content": f"SPREADSHEET DATA:\n{context}"})
+
     # Insert conversation history (Phase 3)
     if history:
         for h in history:
@@ -458,34 +514,168 @@ def _call_model(
             if role in ("user", "assistant") and content:
                 messages.append({"role": role, "content": content})
 
-    # Merge context + question into a single user message (Phase 1A)
-    if context:
-        combined = f"SPREADSHEET DATA:\n{context}\n\nQUESTION:\n{user_message}"
-    else:
-        combined = user_message
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+def _call_model(
+    model: str,
+    system_prompt: str,
+    user_message: str,
+    context: str,
+    client: OpenAI | None = None,
+    history: list[dict] | None = None,
+    stop_on_refusal: bool = False,
+    first_chunk: threading.Event | None = None,
+    cancel: threading.Event | None = None,
+) -> str:
+    """Call a model and return the response text.
 
-    messages.append({"role": "user", "content": combined})
+    The reply is streamed, so hitting _MAX_RESPONSE_CHARS closes the stream
+    instead of waiting for (and paying for) the rest. With stop_on_refusal,
+    a reply whose opening already reads as a refusal is cut off the same way;
+    the text returned then still tests as a refusal.
+
+    *first_chunk* is set once the model starts answering. Once *cancel* is
+    set the stream is closed at the next chunk (or never opened) and the
+    partial text returned is meant to be discarded.
+    """
+    if cancel is not None and cancel.is_set():
+        return ""
+    if client is None:
+        client = _get_gemini_client()
 
-    response = client.chat.completions.create(
+    parts = []
+    size = 0
+    check_refusal = stop_on_refusal
+    chunks = _stream_model(model, system_prompt, user_message, context, client, history)
+    try:
+        for delta in chunks:
+            if cancel is not None and cancel.is_set():
+                break
+            if first_chunk is not None and not parts:
+                first_chunk.set()
+            parts.append(delta)
+            size += len(delta)
+            if check_refusal and size >= _REFUSAL_WINDOW:
+                check_refusal = False
+                head = "".join(parts)
+                if _is_refusal(head):
+                    return head
+    finally:
+        chunks.close()
+    return "".join(parts)
+
+
+def _stream_model(
+    model: str,
+    system_prompt: str,
+    user_message: str,
+    context: str,
+    client: OpenAI,
+    history: list[dict] | None = None,
+) -> Iterator[str]:
+    """Call a model with stream=True and yield response text as it arrives."""
+    stream = client.chat.completions.create(
         model=model,
-        messages=messages,
+        messages=_build_messages(system_prompt, user_message, context, history),
         temperature=0.3,
         max_tokens=2000,
         timeout=30,
+        stream=True,
     )
-
-    text = response.choices[0].message.content or ""
-    if len(text) > _MAX_RESPONSE_CHARS:
-        logger.warning(f"LLM response truncated from {len(text)} to {_MAX_RESPONSE_CHARS} chars")
-        text = text[:_MAX_RESPONSE_CHARS] + "\n\n[Response truncated]"
-    return text
+    sent = 0
+    try:
+        for event in stream:
+            if not event.choices:
+                continue
+            delta = event.choices[0].delta.content
+            if not delta:
+                continue
+            if sent + len(delta) > _MAX_RESPONSE_CHARS:
+                logger.warning(f"LLM stream truncated at {_MAX_RESPONSE_CHARS} chars")
+                yield delta[:_MAX_RESPONSE_CHARS - sent] + "\n\n[Response truncated]"
+                return
+            sent += len(delta)
+            yield delta
+    finally:
+        stream.close()
 
 
 def _is_refusal(text: str) -> bool:
     """Check if the AI response is a refusal to answer."""
     # Only flag as refusal if the refusal phrase appears in the first 200 chars
     # (to avoid false positives on longer legitimate responses)
-    return bool(_REFUSAL_PATTERNS.search(text[:200]))
+    head = text[:_REFUSAL_WINDOW].lower()
+    if _REFUSAL_AC is not None:
+        return next(_REFUSAL_AC.iter(head), None) is not None
+    return any(phrase in head for phrase in _REFUSAL_PHRASES)
+
+
+# Hedged fallback: when a model has not started answering (no first chunk)
+# within LLM_HEDGE_DELAY seconds, the next one in the chain is started
+# alongside it and the first usable reply wins. A stalled provider then costs
+# the hedge delay instead of its full 30s timeout, while a model that is
+# already streaming a long answer is left to finish. Once a reply wins, the
+# other attempts stop reading (and so stop generating) at their next chunk.
+# Sized for every attempt of every LLM worker thread (_run_llm allows
+# THREAD_POOL_SIZE at once), so a first attempt never queues behind hedges;
+# no new hedge is started while the pool is full anyway.
+_HEDGE_POOL_SIZE = settings.THREAD_POOL_SIZE * 4
+_hedge_executor = ThreadPoolExecutor(
+    max_workers=_HEDGE_POOL_SIZE,
+    thread_name_prefix="sheetmind-model",
+)
+_hedge_inflight_lock = threading.Lock()
+_hedge_inflight = 0
+
+
+def _hedge_submit(fn, **kwargs) -> Future:
+    """Submit an attempt to _hedge_executor, tracking how many are in flight."""
+    global _hedge_inflight
+    with _hedge_inflight_lock:
+        _hedge_inflight += 1
+    future = _hedge_executor.submit(fn, **kwargs)
+    future.add_done_callback(_hedge_done)
+    return future
+
+
+def _hedge_done(_future: Future) -> None:
+    global _hedge_inflight
+    with _hedge_inflight_lock:
+        _hedge_inflight -= 1
+
+
+def _call_openrouter(
+    model: str,
+    system_prompt: str,
+    user_message: str,
+    context: str,
+    history: list[dict] | None = None,
+    stop_on_refusal: bool = True,
+    first_chunk: threading.Event | None = None,
+    cancel: threading.Event | None = None,
+) -> str:
+    """_call_model() through the shared OpenRouter client."""
+    return _call_model(
+        model, system_prompt, user_message, context,
+        _get_openrouter_client(), history, stop_on_refusal, first_chunk, cancel,
+    )
+
+
+def _call_gemini(
+    system_prompt: str,
+    user_message: str,
+    context: str,
+    history: list[dict] | None = None,
+    first_chunk: threading.Event | None = None,
+    cancel: threading.Event | None = None,
+) -> str:
+    """_call_model() through the shared Gemini client."""
+    return _call_model(
+        PRIMARY_MODEL, system_prompt, user_message, context,
+        _get_gemini_client(), history, True, first_chunk, cancel,
+    )
 
 
 def _call_with_fallback(
@@ -496,70 +686,137 @@ def _call_with_fallback(
     history: list[dict] | None = None,
 ) -> str:
     """Try Arcee Trinity first, then Gemini direct, then OpenRouter Gemini,
-    then GPT-4o-mini as final fallback."""
+    then GPT-4o-mini as final fallback.
 
-    # --- Attempt 1: Arcee Trinity via OpenRouter (free) ---
-    try:
-        result = _call_model(
-            PRIMARY_OR_MODEL, system_prompt, user_message, context,
-            _get_openrouter_client(), history,
-        )
-        if not _is_refusal(result):
-            return result
-        logger.warning(f"Arcee Trinity refused{' for ' + label if label else ''}, trying Gemini")
-    except Exception as e:
-        logger.warning(f"Arcee Trinity failed{' for ' + label if label else ''}: {e}")
-
-    # --- Attempt 2: Gemini direct ---
+    The next model is also started early when the current one is slow to
+    start answering (see LLM_HEDGE_DELAY); the GPT-4o-mini reply is accepted
+    even if it refuses.
+    """
+    for_label = f" for {label}" if label else ""
+    attempts = [
+        ("Arcee Trinity", partial(
+            _call_openrouter, PRIMARY_OR_MODEL, system_prompt, user_message, context, history,
+        )),
+    ]
     if settings.GEMINI_API_KEY and settings.GEMINI_ENABLED:
-        try:
-            result = _call_model(
-                PRIMARY_MODEL, system_prompt, user_message, context,
-                _get_gemini_client(), history,
+        attempts.append(("Gemini", partial(
+            _call_gemini, system_prompt, user_message, context, history,
+        )))
+    attempts.append(("OpenRouter Gemini", partial(
+        _call_openrouter, FALLBACK_MODEL, system_prompt, user_message, context, history,
+    )))
+    attempts.append(("GPT-4o-mini", partial(
+        # Last resort: its reply is used even if it refuses, so read it all
+        _call_openrouter, GPT_FALLBACK_MODEL, system_prompt, user_message, context, history,
+        stop_on_refusal=False,
+    )))
+    last = len(attempts) - 1
+    hedge_delay = settings.LLM_HEDGE_DELAY or None
+
+    running: dict[Future, int] = {}
+    first_chunks = [threading.Event() for _ in attempts]
+    cancel = threading.Event()
+    next_attempt = 0
+    last_error = None
+    hedge_at = 0.0
+
+    def start(i: int) -> None:
+        nonlocal hedge_at
+        running[_hedge_submit(attempts[i][1], first_chunk=first_chunks[i], cancel=cancel)] = i
+        hedge_at = time.monotonic() + (hedge_delay or 0)
+
+    try:
+        while True:
+            if next_attempt <= last and not running:
+                start(next_attempt)
+                next_attempt += 1
+            if not running:
+                break
+            # Hedge only while nothing running has started answering
+            can_hedge = (
+                hedge_delay is not None
+                and next_attempt <= last
+                and not any(first_chunks[i].is_set() for i in running.values())
             )
-            # Phase 1C: refusal detection + retry
-            if _is_refusal(result):
-                logger.warning(f"Gemini refused{' for ' + label if label else ''}, retrying with explicit instruction")
-                retry_msg = (
-                    f"{user_message}\n\n"
-                    "IMPORTANT: You have the spreadsheet data above. "
-                    "Analyze it directly and provide the answer. "
-                    "Do NOT say you cannot access or view the data."
-                )
-                result = _call_model(
-                    PRIMARY_MODEL, system_prompt, retry_msg, context,
-                    _get_gemini_client(), history,
+            timeout = max(0.0, hedge_at - time.monotonic()) if can_hedge else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if any(first_chunks[i].is_set() for i in running.values()):
+                    continue
+                if _hedge_inflight >= _HEDGE_POOL_SIZE:
+                    # Pool is full: a hedge would only queue; check again later
+                    hedge_at = time.monotonic() + hedge_delay
+                    continue
+                logger.warning(
+                    f"{attempts[next_attempt - 1][0]} slow{for_label}, "
+                    f"also trying {attempts[next_attempt][0]}"
                 )
-                if not _is_refusal(result):
+                start(next_attempt)
+                next_attempt += 1
+                continue
+            # Prefer the earliest model in the chain when several finish together
+            for future in sorted(done, key=running.get):
+                i = running.pop(future)
+                name = attempts[i][0]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.warning(f"{name} failed{for_label}: {e}")
+                    last_error = e
+                    continue
+                if i == last or not _is_refusal(result):
                     return result
-                logger.warning("Gemini refused again, falling back")
-            else:
-                return result
-        except Exception as e:
-            logger.warning(f"Gemini direct failed{' for ' + label if label else ''}: {e}")
+                logger.warning(f"{name} refused{for_label}, falling back")
+            # Nothing usable yet: don't wait out the delay to try the next one
+            hedge_at = time.monotonic()
+    finally:
+        # Stop the attempts that lost (or are still queued)
+        cancel.set()
 
-    # --- Attempt 3: OpenRouter Gemini ---
-    try:
-        result = _call_model(
-            FALLBACK_MODEL, system_prompt, user_message, context,
-            _get_openrouter_client(), history,
-        )
-        if not _is_refusal(result):
-            return result
-        logger.warning(f"OpenRouter Gemini refused{' for ' + label if label else ''}, trying GPT fallback")
-    except Exception as e:
-        logger.warning(f"OpenRouter Gemini failed{' for ' + label if label else ''}: {e}")
-
-    # --- Attempt 4: GPT-4o-mini via OpenRouter ---
-    try:
-        result = _call_model(
-            GPT_FALLBACK_MODEL, system_prompt, user_message, context,
-            _get_openrouter_client(), history,
-        )
-        return result
-    except Exception as e2:
-        logger.error(f"GPT-4o-mini fallback failed{' for ' + label if label else ''}: {e2}")
-        raise RuntimeError("AI service unavailable. Please try again later.") from e2
+    logger.error(f"All models failed{for_label}")
+    raise RuntimeError("AI service unavailable. Please try again later.") from last_error
+
+
+# ---------------------------------------------------------------------------
+# Formula answer cache
+# ---------------------------------------------------------------------------
+# Explain/fix answers depend only on the system prompt and the user message
+# (no sheet data, no history), so the same formula explained again — from
+# another cell, or by another user — is served from memory instead of a
+# multi-second model call. Per worker; the route-level Redis cache is per user.
+
+_ANSWER_CACHE_TTL = 3600  # 1 hour
+_ANSWER_CACHE_MAX = 2048  # entries per worker
+
+_answer_cache_lock = threading.Lock()
+_answer_cache: dict[tuple[str, str], tuple[float, str]] = {}
+
+
+def _call_cached(system_prompt: str, user_message: str, label: str) -> str:
+    """_call_with_fallback() without context, memoised by (label, user_message).
+
+    Each label is used with exactly one system prompt, so it stands in for it.
+    """
+    key = (label, user_message)
+    now = time.monotonic()
+    with _answer_cache_lock:
+        entry = _answer_cache.get(key)
+    if entry is not None and now - entry[0] <= _ANSWER_CACHE_TTL:
+        return entry[1]
+
+    result = _call_with_fallback(system_prompt, user_message, "", label)
+    with _answer_cache_lock:
+        _answer_cache.pop(key, None)
+        if len(_answer_cache) >= _ANSWER_CACHE_MAX:
+            _answer_cache.pop(next(iter(_answer_cache)))
+        _answer_cache[key] = (now, result)
+    return result
+
+
+def _forget_cached(user_message: str, label: str) -> None:
+    """Drop an answer that turned out unusable, so the next call asks again."""
+    with _answer_cache_lock:
+        _answer_cache.pop((label, user_message), None)
 
 
 # ---------------------------------------------------------------------------
@@ -586,45 +843,113 @@ def _truncate(text: str, limit: int, label: str = "input") -> str:
 # Public API
 # ---------------------------------------------------------------------------
 
+def build_context(
+    sheet_data: dict | None,
+    sheet_name: str | None,
+    label: str = "sheet context",
+) -> str:
+    """Sheet context for the completion functions, capped at _MAX_CONTEXT_CHARS.
+
+    Build it once and pass it as ``context=`` when one request makes several
+    calls on the same sheet (e.g. an agent plan that falls back to chat).
+    """
+    context = _build_context_message(sheet_data, sheet_name, _MAX_CONTEXT_CHARS)
+    return _truncate(context, _MAX_CONTEXT_CHARS, label)
+
+
 def chat_completion(
     message: str,
     sheet_data: dict | None = None,
     sheet_name: str | None = None,
     history: list[dict] | None = None,
+    context: str | None = None,
 ) -> str:
     """Send a chat query to AI. Tries Gemini direct first, falls back to OpenRouter."""
     message = _truncate(message, _MAX_MESSAGE_CHARS, "chat message")
-    context = _build_context_message(sheet_data, sheet_name)
-    context = _truncate(context, _MAX_CONTEXT_CHARS, "chat context")
+    if context is None:
+        context = build_context(sheet_data, sheet_name, "chat context")
     return _call_with_fallback(SYSTEM_PROMPT, message, context, "chat", history)
 
 
+def chat_completion_stream(
+    message: str,
+    sheet_data: dict | None = None,
+    sheet_name: str | None = None,
+    history: list[dict] | None = None,
+) -> Iterator[str]:
+    """Streaming counterpart of chat_completion: yields the reply as it arrives.
+
+    Walks the same model chain as _call_with_fallback, moving on only while
+    nothing has been yielded yet — once text has reached the client there is
+    no clean way to restart. Refusal detection needs the whole reply, so it
+    is not applied here.
+    """
+    message = _truncate(message, _MAX_MESSAGE_CHARS, "chat message")
+    context = build_context(sheet_data, sheet_name, "chat context")
+
+    attempts = [(PRIMARY_OR_MODEL, _get_openrouter_client)]
+    if settings.GEMINI_API_KEY and settings.GEMINI_ENABLED:
+        attempts.append((PRIMARY_MODEL, _get_gemini_client))
+    attempts.append((FALLBACK_MODEL, _get_openrouter_client))
+    attempts.append((GPT_FALLBACK_MODEL, _get_openrouter_client))
+
+    last_error = None
+    for model, get_client in attempts:
+        started = False
+        try:
+            for chunk in _stream_model(model, SYSTEM_PROMPT, message, context, get_client(), history):
+                started = True
+                yield chunk
+        except Exception as e:
+            if started:
+                raise RuntimeError("AI response was interrupted. Please try again.") from e
+            logger.warning(f"{model} stream failed for chat: {e}")
+            last_error = e
+            continue
+        if started:
+            return
+        logger.warning(f"{model} returned an empty stream for chat, trying next model")
+
+    raise RuntimeError("AI service unavailable. Please try again later.") from last_error
+
+
+def _parse_fenced_json(raw: str) -> dict | None:
+    """Parse a JSON reply, optionally wrapped in a markdown code fence.
+
+    Returns None if the reply is not valid JSON.
+    """
+    cleaned = raw.strip()
+    if cleaned.startswith("```"):
+        _, sep, cleaned = cleaned.partition("\n")
+        if not sep:
+            return None
+        cleaned = cleaned.rsplit("```", 1)[0]
+    try:
+        return orjson.loads(cleaned)
+    except orjson.JSONDecodeError:
+        return None
+
+
 def agent_completion(
     message: str,
     sheet_data: dict | None = None,
     sheet_name: str | None = None,
     history: list[dict] | None = None,
+    context: str | None = None,
 ) -> dict | None:
     """Send an agent-style query that returns a structured execution plan.
 
     Returns parsed JSON dict with steps, or None if parsing fails.
     """
     message = _truncate(message, _MAX_MESSAGE_CHARS, "agent message")
-    context = _build_context_message(sheet_data, sheet_name)
-    context = _truncate(context, _MAX_CONTEXT_CHARS, "agent context")
+    if context is None:
+        context = build_context(sheet_data, sheet_name, "agent context")
     raw = _call_with_fallback(AGENT_SYSTEM_PROMPT, message, context, "agent", history)
 
-    # Try to parse the JSON response
-    try:
-        cleaned = raw.strip()
-        # Remove markdown code fences if present
-        if cleaned.startswith("```"):
-            cleaned = cleaned.split("\n", 1)[1]
-            cleaned = cleaned.rsplit("```", 1)[0].strip()
-        return json.loads(cleaned)
-    except (json.JSONDecodeError, IndexError):
+    plan = _parse_fenced_json(raw)
+    if plan is None:
         logger.warning(f"Agent response was not valid JSON, falling back to chat mode")
-        return None
+    return plan
 
 
 def formula_completion(
@@ -637,39 +962,36 @@ def formula_completion(
     if range_data:
         context = "Cell data:\n"
         for i, row in enumerate(range_data):
-            context += f"  Row {i + 1}: {json.dumps(row)}\n"
+            context += f"  Row {i + 1}: {orjson.dumps(row).decode()}\n"
     context = _truncate(context, _MAX_CONTEXT_CHARS, "formula context")
     return _call_with_fallback(FORMULA_SYSTEM_PROMPT, prompt, context, "formula")
 
 
 def fix_formula(formula: str, error_message: str, sheet_context: str | None = None) -> dict:
     """Fix a broken spreadsheet formula. Returns dict with fixed_formula, what_was_wrong, explanation."""
-    formula = _truncate(formula, _MAX_MESSAGE_CHARS, "fix formula")
+    formula = _truncate(formula.strip(), _MAX_MESSAGE_CHARS, "fix formula")
     user_message = f"Broken formula:\n{formula}\n\nError message:\n{error_message}"
     if sheet_context:
         user_message += f"\n\nSheet context:\n{_truncate(sheet_context, _MAX_CONTEXT_CHARS, 'fix context')}"
 
-    raw = _call_with_fallback(FIX_SYSTEM_PROMPT, user_message, "", "fix")
+    raw = _call_cached(FIX_SYSTEM_PROMPT, user_message, "fix")
 
-    try:
-        cleaned = raw.strip()
-        if cleaned.startswith("```"):
-            cleaned = cleaned.split("\n", 1)[1]
-            cleaned = cleaned.rsplit("```", 1)[0]
-        return json.loads(cleaned)
-    except (json.JSONDecodeError, IndexError):
+    fixed = _parse_fenced_json(raw)
+    if fixed is None:
+        _forget_cached(user_message, "fix")
         return {
             "fixed_formula": "",
             "what_was_wrong": "Could not parse AI response",
             "explanation": raw,
         }
+    return fixed
 
 
 def explain_formula(formula: str) -> str:
     """Explain a spreadsheet formula in plain English."""
-    formula = _truncate(formula, _MAX_MESSAGE_CHARS, "explain formula")
+    formula = _truncate(formula.strip(), _MAX_MESSAGE_CHARS, "explain formula")
     user_message = f"Explain this spreadsheet formula:\n\n{formula}"
-    return _call_with_fallback(EXPLAIN_SYSTEM_PROMPT, user_message, "", "explain")
+    return _call_cached(EXPLAIN_SYSTEM_PROMPT, user_message, "explain")
 
 
 # ---------------------------------------------------------------------------
@@ -733,7 +1055,7 @@ def generate_chart_config(
         parts.append(f"Chart type requested: {chart_type}")
     if title:
         parts.append(f"Chart title: {title}")
-    data_str = _truncate(json.dumps(data), _MAX_CONTEXT_CHARS, "chart data")
+    data_str = _truncate(orjson.dumps(data).decode(), _MAX_CONTEXT_CHARS, "chart data")
     parts.append(f"Data:\n{data_str}")
     user_message = "\n".join(parts)
     return _call_with_fallback(CHART_SYSTEM_PROMPT, user_message, "", "chart")
@@ -741,20 +1063,17 @@ def generate_chart_config(
 
 def explain_formula_enhanced(formula: str) -> dict:
     """Explain a formula with step-by-step breakdown. Returns parsed dict."""
-    formula = _truncate(formula, _MAX_MESSAGE_CHARS, "enhanced explain formula")
+    formula = _truncate(formula.strip(), _MAX_MESSAGE_CHARS, "enhanced explain formula")
     user_message = f"Explain this spreadsheet formula step by step:\n\n{formula}"
-    raw = _call_with_fallback(ENHANCED_EXPLAIN_SYSTEM_PROMPT, user_message, "", "enhanced_explain")
+    raw = _call_cached(ENHANCED_EXPLAIN_SYSTEM_PROMPT, user_message, "enhanced_explain")
 
-    try:
-        cleaned = raw.strip()
-        if cleaned.startswith("```"):
-            cleaned = cleaned.split("\n", 1)[1]
-            cleaned = cleaned.rsplit("```", 1)[0]
-        return json.loads(cleaned)
-    except (json.JSONDecodeError, IndexError):
+    explained = _parse_fenced_json(raw)
+    if explained is None:
+        _forget_cached(user_message, "enhanced_explain")
         return {
             "summary": raw,
             "steps": [],
             "simpler_alternative": None,
             "full_explanation": raw,
         }
+    return explained
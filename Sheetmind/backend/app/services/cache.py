@@ -5,13 +5,32 @@ Cache key: hash of (user_id, prompt, sheet_data_hash, endpoint_type)
 Default TTL: 1 hour (configurable)
 
 Falls open: if Redis is unavailable, requests go straight to AI.
+
+Cached values hold only the response (text, scores, source references);
+the sheet payload is part of the key hash, never of the value, and
+request-specific fields are dropped before storing (_UNCACHED_FIELDS).
+
+Semantic tier: natural-language prompts (chat, formula execute) also match
+earlier prompts that mean the same thing ("sum col A" / "add up column A")
+by embedding similarity, scoped to the same user, endpoint and sheet data,
+and to prompts naming the same cells, numbers, operations, months and
+words found in the sheet's cells (see _prompt_anchors), which embeddings
+alone don't reliably tell apart.
 """
 
+import asyncio
+import base64
 import hashlib
 import json
 import logging
+import math
+import operator
+import re
 import time
+from array import array
+from functools import lru_cache, partial
 
+import orjson
 import redis
 
 from app.core.config import settings
@@ -19,6 +38,10 @@ from app.core.config import settings
 logger = logging.getLogger(__name__)
 
 CACHE_TTL = 3600  # 1 hour in seconds
+# Never stored: per-request timing, and sheet payloads that are already
+# covered by the key and would make the value as large as the sheet
+_UNCACHED_FIELDS = ("_profile", "sheet_data", "sheet_metadata")
+_SEMANTIC_MAX_ENTRIES = 50  # prompts compared per (user, endpoint, data) bucket
 _REDIS_RETRY_INTERVAL = 60  # seconds before retrying a failed Redis connection
 
 _redis_client: redis.Redis | None = None
@@ -67,15 +90,33 @@ def _get_redis() -> redis.Redis | None:
         return None
 
 
+def _digest(params: dict) -> str:
+    """Hex digest of request params, independent of dict key order.
+
+    Called on every cached request with the full sheet payload, so it uses
+    orjson and BLAKE2b rather than json.dumps and SHA-256 (several times
+    faster on large sheets). Falls back to json for values orjson rejects
+    (e.g. integers beyond 64 bits).
+    """
+    try:
+        raw = orjson.dumps(
+            params,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+            default=str,
+        )
+    except orjson.JSONEncodeError:
+        raw = json.dumps(params, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(raw, digest_size=12).hexdigest()
+
+
 def _make_key(user_id: str, endpoint: str, prompt: str, data: dict | list | None = None) -> str:
     """Build a deterministic cache key from request params."""
-    raw = json.dumps({
+    digest = _digest({
         "user_id": user_id,
         "endpoint": endpoint,
         "prompt": prompt,
         "data": data,
-    }, sort_keys=True, default=str)
-    digest = hashlib.sha256(raw.encode()).hexdigest()[:24]
+    })
     return f"cache:{endpoint}:{digest}"
 
 
@@ -94,7 +135,7 @@ def get_cached(user_id: str, endpoint: str, prompt: str, data: dict | list | Non
         raw = r.get(key)
         if raw:
             logger.info(f"Cache HIT: {key}")
-            return json.loads(raw)
+            return orjson.loads(raw)
         return None
     except redis.exceptions.ConnectionError as e:
         global _redis_client, _redis_last_fail
@@ -121,8 +162,10 @@ def set_cached(
         return
 
     key = _make_key(user_id, endpoint, prompt, data)
+    if any(field in response for field in _UNCACHED_FIELDS):
+        response = {k: v for k, v in response.items() if k not in _UNCACHED_FIELDS}
     try:
-        r.setex(key, ttl, json.dumps(response, default=str))
+        r.setex(key, ttl, orjson.dumps(response, option=orjson.OPT_NON_STR_KEYS, default=str))
         logger.info(f"Cache SET: {key} (TTL={ttl}s)")
     except redis.exceptions.ConnectionError as e:
         global _redis_client, _redis_last_fail
@@ -144,3 +187,221 @@ def invalidate(user_id: str, endpoint: str, prompt: str, data: dict | list | Non
         r.delete(key)
     except Exception as e:
         logger.warning(f"Cache invalidate failed: {e}")
+
+
+# Cell refs, numbers and "column X" mentions. Prompts that differ only in
+# these ("sum column A" vs "sum column B") embed almost identically, so they
+# are part of the bucket key and never match each other semantically.
+_ANCHOR_RE = re.compile(r"\bcol(?:umn)?\s+([a-z]{1,3})\b|\b(?:[a-z]{1,3}\d+|\d+(?:\.\d+)?)\b")
+
+# Words that flip the answer while barely moving the embedding ("highest
+# revenue" / "lowest revenue", "top 5" / "bottom 5", "ascending" /
+# "descending"). Each maps to the operation it names, so synonyms still share
+# a bucket but opposite operations never do.
+_OPERATION_WORDS = {
+    **dict.fromkeys(("sum", "total", "totals", "add"), "sum"),
+    **dict.fromkeys(("average", "averages", "avg", "mean"), "avg"),
+    **dict.fromkeys(("count", "many"), "count"),
+    "median": "median",
+    **dict.fromkeys((
+        "max", "maximum", "highest", "largest", "biggest", "greatest", "most", "top",
+    ), "max"),
+    **dict.fromkeys((
+        "min", "minimum", "lowest", "smallest", "least", "fewest", "bottom",
+    ), "min"),
+    **dict.fromkeys(("greater", "more", "above", "over", "exceed", "exceeds", ">", ">="), "gt"),
+    **dict.fromkeys(("less", "fewer", "below", "under", "<", "<="), "lt"),
+    **dict.fromkeys(("equal", "equals", "="), "eq"),
+    **dict.fromkeys(("ascending", "asc", "increasing"), "asc"),
+    **dict.fromkeys(("descending", "desc", "decreasing"), "desc"),
+    **dict.fromkeys((
+        "not", "no", "without", "except", "excluding", "exclude", "never", "non", "!=",
+    ), "not"),
+}
+_WORD_RE = re.compile(r"[a-z]+n't|[a-z]+|[<>!]?=|[<>]")
+
+
+# Month names anchor even when the sheet stores dates rather than the words
+_MONTHS = (
+    "january", "february", "march", "april", "may", "june",
+    "july", "august", "september", "october", "november", "december",
+)
+_MONTH_WORDS = {
+    **{m: m for m in _MONTHS},
+    **{m[:3]: m for m in _MONTHS},
+    "sept": "september",
+}
+# Filler that also turns up in cell text; not worth splitting buckets over
+_STOPWORDS = frozenset((
+    "a", "an", "and", "are", "as", "at", "by", "for", "from", "in", "is", "it",
+    "of", "on", "or", "the", "to", "what", "which", "with",
+))
+
+
+def _sheet_words(data: dict | list | None, wanted: set[str]) -> set[str]:
+    """The words of ``wanted`` that appear in any text cell of the sheet."""
+    if not wanted:
+        return set()
+    if isinstance(data, dict):
+        cells = data.get("cells")
+        if isinstance(cells, dict):
+            values = cells.values()
+        else:
+            values = [data.get("headers") or [], *(data.get("rows") or [])]
+    elif isinstance(data, list):
+        values = data
+    else:
+        return set()
+
+    found = set()
+    for value in values:
+        for v in (value if isinstance(value, list) else (value,)):
+            if isinstance(v, str):
+                found.update(wanted.intersection(_WORD_RE.findall(v.lower())))
+                if found == wanted:
+                    return found
+    return found
+
+
+def _prompt_anchors(prompt: str, data: dict | list | None = None) -> list[str]:
+    prompt = prompt.lower()
+    anchors = set()
+    for m in _ANCHOR_RE.finditer(prompt):
+        anchors.add(f"col:{m.group(1)}" if m.group(1) else m.group(0))
+    other = set()
+    for word in _WORD_RE.findall(prompt):
+        if word.endswith("n't"):
+            anchors.add("op:not")
+        elif word in _OPERATION_WORDS:
+            anchors.add(f"op:{_OPERATION_WORDS[word]}")
+        elif word in _MONTH_WORDS:
+            anchors.add(f"month:{_MONTH_WORDS[word]}")
+        elif word not in _STOPWORDS:
+            other.add(word)
+    # Headers and filter values: "total sales" vs "total profit", "sales for
+    # north" vs "sales for south" differ by one word the sheet itself contains
+    anchors.update(f"value:{word}" for word in _sheet_words(data, other))
+    return sorted(anchors)
+
+
+def _make_semantic_key(user_id: str, endpoint: str, prompt: str, data: dict | list | None = None) -> str:
+    """Build the key of the Redis list holding prompt embeddings for a bucket."""
+    digest = _digest({
+        "user_id": user_id,
+        "endpoint": endpoint,
+        "anchors": _prompt_anchors(prompt, data),
+        "data": data,
+    })
+    return f"semcache:{endpoint}:{digest}"
+
+
+@lru_cache(maxsize=256)
+def _embed_prompt(prompt: str) -> array:
+    """Embed a prompt as a unit-length float32 vector.
+
+    Reuses the RAG embedding model. Cached so the lookup on a miss and the
+    store that follows it pay for one embedding call, not two.
+    """
+    from app.services.rag_system import _get_embeddings
+
+    embeddings, _ = _get_embeddings()
+    vec = embeddings.embed_query(prompt)
+    norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+    return array("f", (x / norm for x in vec))
+
+
+def get_cached_semantic(user_id: str, endpoint: str, prompt: str, data: dict | list | None = None) -> dict | None:
+    """
+    Look up a cached response by exact key, then by prompt similarity.
+
+    The embedding call only happens when the bucket already holds prompts,
+    so first requests for a sheet cost nothing extra.
+    """
+    cached = get_cached(user_id, endpoint, prompt, data)
+    if cached is not None or not settings.SEMANTIC_CACHE_ENABLED:
+        return cached
+
+    r = _get_redis()
+    if r is None:
+        return None
+
+    try:
+        entries = r.lrange(_make_semantic_key(user_id, endpoint, prompt, data), 0, -1)
+        if not entries:
+            return None
+        query = _embed_prompt(prompt)
+
+        best_key, best_score = None, settings.SEMANTIC_CACHE_THRESHOLD
+        for entry in entries:
+            item = orjson.loads(entry)
+            vec = array("f", base64.b64decode(item["vec"]))
+            if len(vec) != len(query):
+                continue
+            score = sum(map(operator.mul, query, vec))
+            if score >= best_score:
+                best_key, best_score = item["key"], score
+
+        if best_key is None:
+            return None
+        raw = r.get(best_key)
+        if raw:
+            logger.info(f"Cache HIT (semantic, {best_score:.3f}): {best_key}")
+            return orjson.loads(raw)
+        return None
+    except Exception as e:
+        logger.warning(f"Semantic cache get failed: {e}")
+        return None
+
+
+def set_cached_semantic(
+    user_id: str,
+    endpoint: str,
+    prompt: str,
+    response: dict,
+    data: dict | list | None = None,
+    ttl: int = CACHE_TTL,
+) -> None:
+    """Store a response and register its prompt embedding for semantic lookups."""
+    set_cached(user_id, endpoint, prompt, response, data, ttl)
+    if not settings.SEMANTIC_CACHE_ENABLED:
+        return
+
+    r = _get_redis()
+    if r is None:
+        return
+
+    try:
+        vec = _embed_prompt(prompt)
+        entry = orjson.dumps({
+            "key": _make_key(user_id, endpoint, prompt, data),
+            "vec": base64.b64encode(vec.tobytes()).decode(),
+        })
+        list_key = _make_semantic_key(user_id, endpoint, prompt, data)
+        pipe = r.pipeline(transaction=False)
+        pipe.lpush(list_key, entry)
+        pipe.ltrim(list_key, 0, _SEMANTIC_MAX_ENTRIES - 1)
+        pipe.expire(list_key, ttl)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Semantic cache set failed: {e}")
+
+
+# Strong references to cache writes started by set_cached_in_background (the
+# event loop only keeps weak ones) until they finish
+_background_writes: set[asyncio.Future] = set()
+
+
+def set_cached_in_background(setter, **kwargs) -> None:
+    """Run ``setter`` (set_cached or set_cached_semantic) off the event loop, unawaited.
+
+    Must be called from the event loop. Failures are logged, never raised.
+    """
+    future = asyncio.get_running_loop().run_in_executor(None, partial(setter, **kwargs))
+    _background_writes.add(future)
+    future.add_done_callback(_background_write_done)
+
+
+def _background_write_done(future: asyncio.Future) -> None:
+    _background_writes.discard(future)
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"Background cache write failed: {future.exception()}")
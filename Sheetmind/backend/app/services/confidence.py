@@ -7,6 +7,11 @@ Calculates a 0-100 score based on multiple factors and maps it to a tier:
   - Red (<70): Low confidence — manual review required
 """
 
+import re
+
+_NUMBER_RE = re.compile(r'\d+\.?\d*')
+_REFERENCE_RE = re.compile(r'[Rr]ow\s*\d+|[Cc]ell\s*[A-Z]+\d+|[A-Z]+\d+:[A-Z]+\d+')
+
 
 def _data_completeness_score(sheet_data: dict | None) -> float:
     """Score based on how complete the provided data is (0-100)."""
@@ -103,15 +108,11 @@ def _response_quality_score(response: str) -> float:
     score = 70.0
 
     # Contains specific numbers = better
-    import re
-    numbers = re.findall(r'\d+\.?\d*', sample)
-    if numbers:
+    if _NUMBER_RE.search(sample):
         score += 10.0
 
     # Contains row/cell references = better (verifiable)
-    ref_patterns = [r'[Rr]ow\s*\d+', r'[Cc]ell\s*[A-Z]+\d+', r'[A-Z]+\d+:[A-Z]+\d+']
-    has_references = any(re.search(p, sample) for p in ref_patterns)
-    if has_references:
+    if _REFERENCE_RE.search(sample):
         score += 10.0
 
     # Very short response for a complex query might be suspect
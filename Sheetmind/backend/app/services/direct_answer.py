@@ -0,0 +1,203 @@
+"""
+Direct answers — reply to trivially answerable chat messages without an LLM.
+
+Handles three shapes of message:
+- Greetings and thanks ("hi", "thank you")
+- An aggregate over an explicit A1 range ("sum of B2:B20", "average C2:C50")
+- Sheet size questions ("how many rows are there?")
+
+Anything that needs interpretation (column names, conditions, grouping)
+returns None and goes to the model as before. Answers are computed from
+the cells the sidebar sent, so ranges reaching past a truncated read are
+declined rather than answered from partial data.
+"""
+
+import logging
+import re
+
+from app.services.sheet_analyzer import _parse_numeric
+
+logger = logging.getLogger(__name__)
+
+_MAX_RANGE_CELLS = 100_000
+
+_GREETING_REPLIES = [
+    (
+        re.compile(r"^\s*(?:hi|hello|hey|good\s*(?:morning|afternoon|evening))[\s!.?]*$", re.IGNORECASE),
+        "Hi! I can answer questions about your sheet, write formulas, and build "
+        "summaries or charts. What would you like to do?",
+    ),
+    (
+        re.compile(r"^\s*thank(?:s|\s*you)[\s!.?]*$", re.IGNORECASE),
+        "You're welcome! Let me know if there's anything else you need.",
+    ),
+]
+
+_AGGREGATE_RE = re.compile(
+    r"^\s*(?:what(?:'s|\s+is)\s+the\s+|calculate\s+(?:the\s+)?|give\s+me\s+the\s+)?"
+    r"(sum|total|average|avg|mean|min(?:imum)?|max(?:imum)?)\s+"
+    r"(?:of\s+)?(?:the\s+)?(?:values\s+in\s+)?(?:range\s+)?"
+    r"([a-z]{1,3})(\d+)\s*:\s*([a-z]{1,3})(\d+)[\s?.!]*$",
+    re.IGNORECASE,
+)
+
+_SIZE_RE = re.compile(
+    r"^\s*how\s+many\s+(rows|columns)\s*"
+    r"(?:are\s+there|(?:are\s+)?in\s+(?:this|the)\s+sheet|does\s+(?:this|the)\s+sheet\s+have)?"
+    r"[\s?.!]*$",
+    re.IGNORECASE,
+)
+
+_CELL_REF_RE = re.compile(r"^([A-Z]+)(\d+)$")
+
+# Aggregate word -> (label, spreadsheet function)
+_AGGREGATES = {
+    "sum": ("sum", "SUM"),
+    "total": ("sum", "SUM"),
+    "average": ("average", "AVERAGE"),
+    "avg": ("average", "AVERAGE"),
+    "mean": ("average", "AVERAGE"),
+    "min": ("minimum", "MIN"),
+    "minimum": ("minimum", "MIN"),
+    "max": ("maximum", "MAX"),
+    "maximum": ("maximum", "MAX"),
+}
+
+
+def _col_to_index(col: str) -> int:
+    index = 0
+    for ch in col:
+        index = index * 26 + (ord(ch) - 64)
+    return index
+
+
+def _index_to_col(index: int) -> str:
+    letters = ""
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _format_number(value: float) -> str:
+    if value.is_integer():
+        return f"{int(value):,}"
+    return f"{value:,.4f}".rstrip("0").rstrip(".")
+
+
+def _last_row_read(sheet_data: dict) -> int | None:
+    """Last sheet row the sidebar actually sent, or None if it sent everything.
+
+    The sidebar caps reads at a fixed row count but still reports the full
+    dataRange; when that range ends below the last row in ``cells``, the
+    payload was truncated.
+    """
+    data_range = sheet_data.get("dataRange") or ""
+    end = _CELL_REF_RE.match(data_range.rsplit(":", 1)[-1].upper())
+    if not end:
+        return None
+    rows = [int(m.group(2)) for m in map(_CELL_REF_RE.match, sheet_data["cells"]) if m]
+    last = max(rows, default=0)
+    return last if last < int(end.group(2)) else None
+
+
+def _aggregate_answer(match: re.Match, sheet_data: dict | None) -> str | None:
+    if not sheet_data or not sheet_data.get("cells"):
+        return None
+    word, c1, r1, c2, r2 = match.groups()
+    label, func = _AGGREGATES[word.lower()]
+    col_lo, col_hi = sorted((_col_to_index(c1.upper()), _col_to_index(c2.upper())))
+    row_lo, row_hi = sorted((int(r1), int(r2)))
+    if row_lo < 1 or (col_hi - col_lo + 1) * (row_hi - row_lo + 1) > _MAX_RANGE_CELLS:
+        return None
+
+    last_read = _last_row_read(sheet_data)
+    if last_read is not None and row_hi > last_read:
+        return None  # Part of the range wasn't sent
+
+    cells = sheet_data["cells"]
+    numbers = []
+    skipped = 0
+    for col_idx in range(col_lo, col_hi + 1):
+        col = _index_to_col(col_idx)
+        for row in range(row_lo, row_hi + 1):
+            value = cells.get(f"{col}{row}")
+            if value is None or value == "":
+                continue
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                numbers.append(float(value))
+                continue
+            parsed = _parse_numeric(str(value))
+            if parsed is None:
+                skipped += 1
+            else:
+                numbers.append(parsed)
+
+    if not numbers:
+        return None  # Nothing numeric: let the model explain what's there
+
+    if func == "SUM":
+        result = sum(numbers)
+    elif func == "AVERAGE":
+        result = sum(numbers) / len(numbers)
+    elif func == "MIN":
+        result = min(numbers)
+    else:
+        result = max(numbers)
+
+    range_ref = f"{_index_to_col(col_lo)}{row_lo}:{_index_to_col(col_hi)}{row_hi}"
+    answer = (
+        f"The {label} of {range_ref} is **{_format_number(result)}** "
+        f"({len(numbers)} numeric cell{'s' if len(numbers) != 1 else ''}"
+    )
+    if skipped:
+        answer += f"; {skipped} non-numeric cell{'s' if skipped != 1 else ''} ignored"
+    return answer + f").\n\nFormula: `={func}({range_ref})`"
+
+
+def _size_answer(match: re.Match, sheet_data: dict | None, sheet_name: str | None) -> str | None:
+    if not sheet_data:
+        return None
+    rows = sheet_data.get("totalRows")
+    cols = sheet_data.get("totalColumns")
+    if not isinstance(rows, int) or not isinstance(cols, int) or rows <= 0:
+        return None
+    name = sheet_name or "This sheet"
+    where = f" ({sheet_data['dataRange']})" if sheet_data.get("dataRange") else ""
+    if match.group(1).lower() == "rows":
+        return (
+            f"'{name}' has **{rows:,}** rows in its data range{where}, "
+            f"which is {rows - 1:,} rows below the header row."
+        )
+    return f"'{name}' has **{cols:,}** columns in its data range{where}."
+
+
+def try_direct_answer(
+    message: str,
+    sheet_data: dict | None,
+    sheet_name: str | None,
+) -> tuple[str, str] | None:
+    """
+    Answer the message without an LLM if it is trivially answerable.
+
+    Returns (kind, answer) — kind is "greeting", "aggregate" or "size" — or
+    None when the message should go to the model.
+    """
+    if len(message) > 120:
+        return None
+
+    for pattern, reply in _GREETING_REPLIES:
+        if pattern.match(message):
+            return "greeting", reply
+
+    match = _AGGREGATE_RE.match(message)
+    if match:
+        answer = _aggregate_answer(match, sheet_data)
+        return ("aggregate", answer) if answer else None
+
+    match = _SIZE_RE.match(message)
+    if match:
+        answer = _size_answer(match, sheet_data, sheet_name)
+        return ("size", answer) if answer else None
+
+    return None
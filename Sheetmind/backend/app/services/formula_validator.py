@@ -9,6 +9,7 @@ Catches structural errors before formulas reach the spreadsheet:
 """
 
 import re
+from functools import lru_cache
 from typing import List, Tuple
 
 # ---------------------------------------------------------------------------
@@ -133,6 +134,15 @@ _RANGE_REF = re.compile(
     r"(?:'[^']*'!)?\$?[A-Z]{1,3}\$?\d+:\$?[A-Z]{1,3}\$?\d+"
 )
 
+# Function call: SUM( , vlookup (
+_FUNC_CALL = re.compile(r"([A-Z_][A-Z_0-9]*)\s*\(", re.IGNORECASE)
+
+# Patterns used by suggest_alternatives (matched against the upper-cased formula)
+_NESTED_IF = re.compile(r'IF\s*\(\s*[^,]+,\s*[^,]+,\s*IF\s*\(')
+_CONCAT_CALL = re.compile(r'CONCAT\s*\(')
+_CONCATENATE_CALL = re.compile(r'CONCATENATE\s*\(')
+_FULL_COLUMN = re.compile(r'[A-Z]:[A-Z]')
+
 
 def validate_formula(formula: str) -> Tuple[bool, List[str]]:
     """
@@ -142,6 +152,18 @@ def validate_formula(formula: str) -> Tuple[bool, List[str]]:
         (is_valid, list_of_errors)
         is_valid is True when there are no errors (warnings may still exist).
     """
+    is_valid, errors = _validate_cached(formula)
+    return is_valid, list(errors)
+
+
+@lru_cache(maxsize=1024)
+def _validate_cached(formula: str) -> Tuple[bool, Tuple[str, ...]]:
+    """validate_formula() memoised per formula; errors as a tuple so callers can't mutate the cache."""
+    is_valid, errors = _validate(formula)
+    return is_valid, tuple(errors)
+
+
+def _validate(formula: str) -> Tuple[bool, List[str]]:
     errors: List[str] = []
 
     if not formula:
@@ -192,22 +214,18 @@ def validate_formula(formula: str) -> Tuple[bool, List[str]]:
         errors.append(f"{abs(depth)} extra closing parenthesis(es)")
 
     # 3. Balanced double quotes
-    quote_count = 0
-    for i, ch in enumerate(body):
-        if ch == '"':
-            quote_count += 1
-    if quote_count % 2 != 0:
+    if body.count('"') % 2 != 0:
         errors.append("Unmatched double quote")
 
     # 4. Check function names
-    func_pattern = re.compile(r"([A-Z_][A-Z_0-9]*)\s*\(", re.IGNORECASE)
-    for m in func_pattern.finditer(body):
+    calls = list(_FUNC_CALL.finditer(body))
+    for m in calls:
         func_name = m.group(1).upper()
         if func_name not in KNOWN_FUNCTIONS:
             errors.append(f"Unknown function: {func_name}")
 
     # 5. Argument count check (best-effort, skip nested formulas)
-    _check_arg_counts(body, errors)
+    _check_arg_counts(body, errors, calls)
 
     return len(errors) == 0, errors
 
@@ -239,11 +257,9 @@ def _count_top_level_args(args_str: str) -> int:
     return count
 
 
-def _check_arg_counts(body: str, errors: List[str]) -> None:
+def _check_arg_counts(body: str, errors: List[str], calls: List[re.Match]) -> None:
     """Check argument counts for top-level function calls."""
-    func_pattern = re.compile(r"([A-Z_][A-Z_0-9]*)\s*\(", re.IGNORECASE)
-
-    for m in func_pattern.finditer(body):
+    for m in calls:
         func_name = m.group(1).upper()
         if func_name not in KNOWN_FUNCTIONS:
             continue
@@ -310,15 +326,15 @@ def suggest_alternatives(formula: str) -> List[str]:
         )
 
     # Nested IF -> IFS
-    if re.search(r'IF\s*\(\s*[^,]+,\s*[^,]+,\s*IF\s*\(', upper):
+    if _NESTED_IF.search(upper):
         suggestions.append(
             "Nested IF detected. Consider IFS() for cleaner multiple-condition logic: "
             "=IFS(cond1, val1, cond2, val2, ..., TRUE, default)."
         )
 
     # CONCAT only takes 2 args — suggest & operator
-    concat_match = re.search(r'CONCAT\s*\(', upper)
-    if concat_match and not re.search(r'CONCATENATE\s*\(', upper):
+    concat_match = _CONCAT_CALL.search(upper)
+    if concat_match and not _CONCATENATE_CALL.search(upper):
         suggestions.append(
             "CONCAT() only accepts exactly 2 arguments. Use the & operator instead: "
             "=A1 & \" - \" & B1. For joining with delimiters use TEXTJOIN()."
@@ -338,7 +354,7 @@ def suggest_alternatives(formula: str) -> List[str]:
         )
 
     # Full column references
-    if re.search(r'[A-Z]:[A-Z]', upper):
+    if _FULL_COLUMN.search(upper):
         suggestions.append(
             "Full column references (e.g., A:A) detected. Use bounded ranges "
             "(e.g., A2:A1000) for better performance."
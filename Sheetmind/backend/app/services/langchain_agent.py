@@ -28,7 +28,7 @@ from app.services.langchain_tools import (
     verify_actions,
 )
 from app.services.rag_system import get_rag
-from app.services.sheet_analyzer import analyze_sheet, format_metadata_for_prompt, SheetMetadata
+from app.services.sheet_analyzer import analyze_sheet_cached, format_metadata_for_prompt, SheetMetadata
 from app.services.formula_patterns import get_all_patterns_summary
 from app.services.formula_category_docs import (
     classify_formula_intent, get_category_docs, get_mini_cheat_sheet
@@ -303,7 +303,7 @@ class SheetMindAgent:
             # === PRE-PROCESSING LAYER ===
             # Analyze sheet structure BEFORE agent runs
             analysis_start = time.time()
-            metadata = analyze_sheet(cells, effective_sheet_name)
+            metadata = analyze_sheet_cached(cells, effective_sheet_name)
             timing["analysis_ms"] = int((time.time() - analysis_start) * 1000)
 
             # Extract key values for prompt
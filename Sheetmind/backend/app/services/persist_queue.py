@@ -0,0 +1,128 @@
+"""
+Chat persistence queue — coalesces per-reply writes into batched RPC calls.
+
+Every chat reply used to fire its own persist_chat RPC. Under load that is
+one PostgREST round-trip (and one pooled connection) per reply. Replies are
+queued instead and a single worker flushes them every _FLUSH_INTERVAL
+seconds or _BATCH_SIZE rows through persist_chat_turn_batch
+(migrations/007), one transaction per batch. A row carrying a title also
+creates its conversation, so a new chat needs no separate insert.
+
+If a batch fails (function not deployed, one bad row), its rows are handed
+to the per-row fallback registered at startup, so nothing is dropped that
+the old path would have saved. If the worker isn't running (tests, or
+before startup), enqueue_chat returns False and callers persist directly.
+"""
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+
+import orjson
+
+from app.core.database import get_postgrest_async
+
+logger = logging.getLogger(__name__)
+
+_BATCH_SIZE = 50
+_FLUSH_INTERVAL = 0.2  # seconds to wait for more rows after the first
+_QUEUE_MAX = 5000  # beyond this, callers fall back to direct writes
+
+_queue: asyncio.Queue | None = None
+_worker: asyncio.Task | None = None
+_fallback: Callable[[dict], Awaitable[None]] | None = None
+
+
+def start_persist_worker(fallback: Callable[[dict], Awaitable[None]]) -> None:
+    """Start the flush worker on the running loop (called on app startup).
+
+    ``fallback`` persists a single row the unbatched way; it is used for
+    every row of a batch the RPC could not store.
+    """
+    global _queue, _worker, _fallback
+    _queue = asyncio.Queue(maxsize=_QUEUE_MAX)
+    _fallback = fallback
+    _worker = asyncio.create_task(_drain(), name="sheetmind-persist")
+
+
+async def stop_persist_worker(timeout: float = 5.0) -> None:
+    """Flush whatever is still queued, then stop the worker (called on shutdown)."""
+    global _queue, _worker
+    if _worker is None:
+        return
+    try:
+        await asyncio.wait_for(_queue.join(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Persist queue not drained on shutdown ({_queue.qsize()} rows left)")
+    _worker.cancel()
+    try:
+        await _worker
+    except asyncio.CancelledError:
+        pass
+    _queue = None
+    _worker = None
+
+
+def enqueue_chat(row: dict) -> bool:
+    """Queue one chat exchange for persistence.
+
+    ``row`` keys: conversation_id, user_id, user_message, ai_response,
+    confidence_score, sources, title (None unless the exchange starts a new
+    conversation). Returns False if the row was not queued
+    (worker not running or queue full) — the caller should persist it itself.
+    """
+    if _queue is None:
+        return False
+    try:
+        _queue.put_nowait(row)
+    except asyncio.QueueFull:
+        logger.warning("Persist queue full, writing directly")
+        return False
+    return True
+
+
+async def _drain() -> None:
+    """Collect rows into batches and flush them, forever."""
+    loop = asyncio.get_running_loop()
+    while True:
+        rows = [await _queue.get()]
+        deadline = loop.time() + _FLUSH_INTERVAL
+        while len(rows) < _BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                rows.append(await asyncio.wait_for(_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        try:
+            await _flush(rows)
+        except Exception as e:
+            logger.error(f"Persist batch of {len(rows)} failed: {e}")
+        finally:
+            for _ in rows:
+                _queue.task_done()
+
+
+async def _flush(rows: list[dict]) -> None:
+    """Store a batch with one RPC call, falling back to per-row writes."""
+    try:
+        response = await get_postgrest_async().post(
+            "/rpc/persist_chat_turn_batch",
+            content=orjson.dumps({"p_rows": rows}),
+            headers={"Content-Type": "application/json"},
+        )
+        if response.is_success:
+            stored = response.json()
+            if stored != len(rows):
+                logger.error(f"Persist batch stored {stored}/{len(rows)} rows (missing conversations)")
+            return
+        logger.warning(f"persist_chat_turn_batch RPC returned {response.status_code}, persisting rows individually")
+    except Exception as e:
+        logger.warning(f"persist_chat_turn_batch RPC unavailable, persisting rows individually: {e}")
+
+    for row in rows:
+        try:
+            await _fallback(row)
+        except Exception as e:
+            logger.error(f"Background DB persist failed: {e}")
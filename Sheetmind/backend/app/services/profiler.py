@@ -7,6 +7,9 @@ Usage:
     result = do_ai_call()
     timer.stop("ai_call")
     print(timer.summary())  # -> {"ai_call": 3210, "total": 3215, ...}
+
+Pass enabled=False (requests that didn't ask for ?profile=true) to skip the
+per-step bookkeeping; log() then records only the request total.
 """
 
 import time
@@ -18,19 +21,22 @@ logger = logging.getLogger(__name__)
 class StepTimer:
     """Tracks elapsed time for named steps within a single request."""
 
-    def __init__(self):
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
         self._start_time = time.perf_counter()
         self._steps: dict[str, dict] = {}
         self._order: list[str] = []
 
     def start(self, name: str) -> None:
+        if not self.enabled:
+            return
         self._steps[name] = {"start": time.perf_counter(), "end": None, "ms": None}
         if name not in self._order:
             self._order.append(name)
 
     def stop(self, name: str) -> float:
         """Stop a step timer. Returns elapsed ms."""
-        if name not in self._steps:
+        if not self.enabled or name not in self._steps:
             return 0.0
         end = time.perf_counter()
         self._steps[name]["end"] = end
@@ -40,6 +46,8 @@ class StepTimer:
 
     def mark(self, name: str, ms: float) -> None:
         """Manually record a step duration."""
+        if not self.enabled:
+            return
         self._steps[name] = {"start": None, "end": None, "ms": round(ms, 1)}
         if name not in self._order:
             self._order.append(name)
@@ -67,6 +75,10 @@ class StepTimer:
 
     def log(self, label: str = "Request") -> dict:
         """Log the summary and return it."""
+        if not self.enabled:
+            total_ms = round((time.perf_counter() - self._start_time) * 1000, 1)
+            logger.info(f"[PROFILE] {label}: total {total_ms}ms")
+            return {"steps": {"total": f"{total_ms}ms"}}
         s = self.summary()
         logger.info(f"[PROFILE] {label}: {s['breakdown']}")
         return s
@@ -9,10 +9,14 @@ Enables semantic search across sheets with 500+ rows by:
 Supports Google embeddings with OpenRouter API-based fallback.
 """
 
+import asyncio
 import hashlib
 import json
 import logging
 import re
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
@@ -22,6 +26,17 @@ from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Chroma reads and writes are local CPU/disk work that can take seconds for
+# a large sheet. They get their own small pool so a burst of indexing can't
+# occupy the default executor that auth, Redis and Supabase calls run on.
+_rag_executor = ThreadPoolExecutor(
+    max_workers=settings.RAG_THREAD_POOL_SIZE,
+    thread_name_prefix="sheetmind-rag",
+)
+
+_CELL_REF_RE = re.compile(r"^([A-Z]+)(\d+)$")
+_ROW_PREFIX_RE = re.compile(r"[A-Z]+(\d+)")
+
 # ---------------------------------------------------------------------------
 # Lazy imports for embeddings (avoid import errors if not installed)
 # ---------------------------------------------------------------------------
@@ -83,6 +98,59 @@ def _get_embeddings():
     raise RuntimeError("No embedding model available. Provide GEMINI_API_KEY or OPENROUTER_API_KEY.")
 
 
+# Row text -> embedding, shared across sheets and index versions. Editing
+# one row of a sheet changes its hash and forces a re-index; with this cache
+# only the edited row goes back to the embedding API. Keyed by embedding
+# type as well, since vectors from different models aren't comparable.
+# Stored as float32 arrays (a 1536-dim vector is 6 KB instead of ~50 KB as
+# a list); oldest entries are evicted first.
+_row_vectors: Dict[Tuple[str, bytes], array] = {}
+_row_vectors_lock = threading.Lock()
+
+
+def _row_key(embedding_type: str, text: str) -> Tuple[str, bytes]:
+    return embedding_type, hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+def _cached_row_vectors(embedding_type: str, texts: List[str]) -> List[Optional[List[float]]]:
+    """Cached vector for each text, or None where it hasn't been embedded."""
+    with _row_vectors_lock:
+        hits = [_row_vectors.get(_row_key(embedding_type, t)) for t in texts]
+    return [h.tolist() if h is not None else None for h in hits]
+
+
+def _remember_row_vectors(embedding_type: str, texts: List[str], vectors: List[List[float]]) -> None:
+    limit = settings.RAG_ROW_VECTOR_CACHE_SIZE
+    entries = [(_row_key(embedding_type, t), array("f", v)) for t, v in zip(texts, vectors)]
+    with _row_vectors_lock:
+        for key, vec in entries[-limit:] if limit > 0 else ():
+            _row_vectors.pop(key, None)
+            if len(_row_vectors) >= limit:
+                _row_vectors.pop(next(iter(_row_vectors)))
+            _row_vectors[key] = vec
+
+
+class _PrecomputedEmbeddings:
+    """Embeddings adapter that hands Chroma vectors computed ahead of time.
+
+    Lets the indexers embed only rows missing from the row vector cache
+    (with the async client in index_sheet_async) and then build the
+    collection without a second embedding pass. Queries on the resulting
+    vectorstore go to the real embeddings model.
+    """
+
+    def __init__(self, texts: List[str], vectors: List[List[float]], embeddings):
+        # Keyed by text: Chroma may add the documents in several batches
+        self._vectors = dict(zip(texts, vectors))
+        self._embeddings = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vectors[t] for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embeddings.embed_query(text)
+
+
 # ---------------------------------------------------------------------------
 # Chroma Directory Setup
 # ---------------------------------------------------------------------------
@@ -157,14 +225,12 @@ class SheetRAG:
         Convert spreadsheet cells to LangChain documents.
         Each row becomes a document with metadata.
         """
-        cell_pattern = re.compile(r"^([A-Z]+)(\d+)$")
-
         # Parse cells into rows and extract headers
         rows: Dict[int, Dict[str, str]] = {}
         headers: Dict[str, str] = {}
 
         for cell_ref, value in cells.items():
-            match = cell_pattern.match(cell_ref)
+            match = _CELL_REF_RE.match(cell_ref)
             if not match:
                 continue
 
@@ -206,27 +272,22 @@ class SheetRAG:
 
         return documents
 
-    def index_sheet(
+    def _prepare_index(
         self,
         cells: Dict,
         sheet_name: str,
-        force_reindex: bool = False
-    ) -> Dict:
-        """
-        Index a sheet's data for semantic search.
-
-        Args:
-            cells: Dictionary of cell references to values
-            sheet_name: Name of the sheet
-            force_reindex: If True, reindex even if unchanged
+        force_reindex: bool = False,
+    ) -> Tuple[Optional[Dict], str, str, List[Document]]:
+        """Work out what index_sheet needs to do, without embedding anything.
 
-        Returns:
-            Status dict with indexed row count and embedding type
+        Returns (early_result, collection_name, sheet_hash, documents); when
+        early_result is set (already indexed, no data, chromadb missing) the
+        caller returns it as-is.
         """
         try:
-            from langchain_community.vectorstores import Chroma
+            from langchain_community.vectorstores import Chroma  # noqa: F401
         except ImportError:
-            return {"error": "chromadb not installed", "indexed": 0}
+            return {"error": "chromadb not installed", "indexed": 0}, "", "", []
 
         sheet_hash = self._get_sheet_hash(cells)
         collection_name = f"{sheet_name}_{sheet_hash}".replace(" ", "_")
@@ -237,7 +298,7 @@ class SheetRAG:
                 "status": "already_indexed",
                 "collection": collection_name,
                 "embedding_type": self._embedding_type,
-            }
+            }, collection_name, sheet_hash, []
 
         # Clean up old versions of this sheet's index before creating new one
         self._cleanup_old_versions(sheet_name, keep_collection=collection_name)
@@ -246,20 +307,26 @@ class SheetRAG:
         documents = self._cells_to_documents(cells, sheet_name)
 
         if not documents:
-            return {"status": "no_data", "indexed": 0}
+            return {"status": "no_data", "indexed": 0}, collection_name, sheet_hash, []
 
-        # Get embeddings
-        try:
-            embeddings = self._ensure_embeddings()
-        except RuntimeError as e:
-            return {"error": str(e), "indexed": 0}
+        return None, collection_name, sheet_hash, documents
+
+    def _store_index(
+        self,
+        sheet_name: str,
+        collection_name: str,
+        sheet_hash: str,
+        documents: List[Document],
+        embedding,
+    ) -> Dict:
+        """Build the Chroma collection for prepared documents and register it."""
+        from langchain_community.vectorstores import Chroma
 
-        # Create vector store
         try:
             persist_path = str(CHROMA_DIR / collection_name)
             vectorstore = Chroma.from_documents(
                 documents=documents,
-                embedding=embeddings,
+                embedding=embedding,
                 persist_directory=persist_path,
                 collection_name=collection_name,
             )
@@ -281,6 +348,132 @@ class SheetRAG:
             logger.error(f"Failed to index sheet: {e}")
             return {"error": str(e), "indexed": 0}
 
+    def index_sheet(
+        self,
+        cells: Dict,
+        sheet_name: str,
+        force_reindex: bool = False
+    ) -> Dict:
+        """
+        Index a sheet's data for semantic search.
+
+        Args:
+            cells: Dictionary of cell references to values
+            sheet_name: Name of the sheet
+            force_reindex: If True, reindex even if unchanged
+
+        Returns:
+            Status dict with indexed row count and embedding type
+        """
+        early, collection_name, sheet_hash, documents = self._prepare_index(
+            cells, sheet_name, force_reindex,
+        )
+        if early is not None:
+            return early
+
+        texts = [d.page_content for d in documents]
+        try:
+            embeddings = self._ensure_embeddings()
+            vectors, missing = self._reuse_row_vectors(texts, force_reindex)
+            if missing:
+                fresh = embeddings.embed_documents([texts[i] for i in missing])
+                self._fill_row_vectors(texts, vectors, missing, fresh)
+        except Exception as e:
+            logger.error(f"Failed to embed sheet: {e}")
+            return {"error": str(e), "indexed": 0}
+
+        return self._store_index(
+            sheet_name, collection_name, sheet_hash, documents,
+            _PrecomputedEmbeddings(texts, vectors, embeddings),
+        )
+
+    async def index_sheet_async(
+        self,
+        cells: Dict,
+        sheet_name: str,
+        force_reindex: bool = False
+    ) -> Dict:
+        """
+        Async variant of index_sheet for request handlers.
+
+        The embedding API call — the slow, network-bound part — is awaited
+        on the embeddings client's async method instead of holding a worker
+        thread, and only covers rows not already in the row vector cache.
+        Document building and the local Chroma write are CPU/disk steps and
+        run on _rag_executor.
+        """
+        loop = asyncio.get_running_loop()
+        early, collection_name, sheet_hash, documents = await loop.run_in_executor(
+            _rag_executor, self._prepare_index, cells, sheet_name, force_reindex,
+        )
+        if early is not None:
+            return early
+
+        texts = [d.page_content for d in documents]
+        try:
+            embeddings = self._ensure_embeddings()
+            vectors, missing = self._reuse_row_vectors(texts, force_reindex)
+            if missing:
+                fresh = await embeddings.aembed_documents([texts[i] for i in missing])
+                self._fill_row_vectors(texts, vectors, missing, fresh)
+        except Exception as e:
+            logger.error(f"Failed to embed sheet: {e}")
+            return {"error": str(e), "indexed": 0}
+
+        return await loop.run_in_executor(
+            _rag_executor, self._store_index,
+            sheet_name, collection_name, sheet_hash, documents,
+            _PrecomputedEmbeddings(texts, vectors, embeddings),
+        )
+
+    def _reuse_row_vectors(
+        self, texts: List[str], force_reindex: bool,
+    ) -> Tuple[List[Optional[List[float]]], List[int]]:
+        """Vectors already known for these row texts, and the indices still to embed."""
+        if force_reindex:
+            return [None] * len(texts), list(range(len(texts)))
+        vectors = _cached_row_vectors(self._embedding_type, texts)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if len(missing) < len(texts):
+            logger.info(f"Reusing {len(texts) - len(missing)}/{len(texts)} cached row embeddings")
+        return vectors, missing
+
+    def _fill_row_vectors(
+        self,
+        texts: List[str],
+        vectors: List[Optional[List[float]]],
+        missing: List[int],
+        fresh: List[List[float]],
+    ) -> None:
+        """Slot freshly embedded vectors into place and remember them."""
+        for i, vec in zip(missing, fresh):
+            vectors[i] = vec
+        _remember_row_vectors(self._embedding_type, [texts[i] for i in missing], fresh)
+
+    def _vectorstore_for(self, cells: Dict, sheet_name: str):
+        """Return the vectorstore for this exact sheet content, if indexed."""
+        sheet_hash = self._get_sheet_hash(cells)
+        collection_name = f"{sheet_name}_{sheet_hash}".replace(" ", "_")
+        return self._vectorstores.get(collection_name)
+
+    @staticmethod
+    def _format_results(results) -> List[Dict]:
+        """Turn Chroma (document, score) pairs into row dicts."""
+        formatted = []
+        for doc, score in results:
+            try:
+                cell_data = json.loads(doc.metadata.get("cells", "{}"))
+            except (json.JSONDecodeError, TypeError):
+                cell_data = {}
+            formatted.append({
+                "row": doc.metadata.get("row"),
+                "content": doc.page_content,
+                "cells": cell_data,
+                "score": float(score),
+                "sheet": doc.metadata.get("sheet"),
+            })
+        return formatted
+
     def search(
         self,
         query: str,
@@ -304,39 +497,61 @@ class SheetRAG:
             k = settings.RAG_RESULTS_COUNT
 
         # Ensure indexed
-        sheet_hash = self._get_sheet_hash(cells)
-        collection_name = f"{sheet_name}_{sheet_hash}".replace(" ", "_")
-
-        if collection_name not in self._vectorstores:
+        vectorstore = self._vectorstore_for(cells, sheet_name)
+        if vectorstore is None:
             result = self.index_sheet(cells, sheet_name)
             if "error" in result:
                 logger.warning(f"RAG indexing failed: {result['error']}")
                 return []
+            vectorstore = self._vectorstore_for(cells, sheet_name)
 
-        vectorstore = self._vectorstores.get(collection_name)
         if not vectorstore:
             return []
 
         try:
             # Search with scores
             results = vectorstore.similarity_search_with_score(query, k=k)
+            return self._format_results(results)
 
-            # Format results
-            formatted = []
-            for doc, score in results:
-                try:
-                    cell_data = json.loads(doc.metadata.get("cells", "{}"))
-                except (json.JSONDecodeError, TypeError):
-                    cell_data = {}
-                formatted.append({
-                    "row": doc.metadata.get("row"),
-                    "content": doc.page_content,
-                    "cells": cell_data,
-                    "score": float(score),
-                    "sheet": doc.metadata.get("sheet"),
-                })
-
-            return formatted
+        except Exception as e:
+            logger.error(f"RAG search failed: {e}")
+            return []
+
+    async def search_async(
+        self,
+        query: str,
+        sheet_name: str,
+        cells: Dict,
+        k: int = None,
+    ) -> List[Dict]:
+        """
+        Async variant of search for request handlers.
+
+        Awaits the query embedding, then runs the local Chroma lookup by
+        vector on _rag_executor. Scores match search().
+        """
+        if k is None:
+            k = settings.RAG_RESULTS_COUNT
+
+        vectorstore = self._vectorstore_for(cells, sheet_name)
+        if vectorstore is None:
+            result = await self.index_sheet_async(cells, sheet_name)
+            if "error" in result:
+                logger.warning(f"RAG indexing failed: {result['error']}")
+                return []
+            vectorstore = self._vectorstore_for(cells, sheet_name)
+
+        if not vectorstore:
+            return []
+
+        try:
+            query_vector = await self._ensure_embeddings().aembed_query(query)
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(
+                _rag_executor, vectorstore.similarity_search_by_vector_with_relevance_scores,
+                query_vector, k,
+            )
+            return self._format_results(results)
 
         except Exception as e:
             logger.error(f"RAG search failed: {e}")
@@ -398,11 +613,11 @@ class SheetRAG:
             max_rows = settings.RAG_RESULTS_COUNT
 
         # Count rows
-        row_count = len(set(
-            int(re.match(r"[A-Z]+(\d+)", ref).group(1))
-            for ref in cells.keys()
-            if re.match(r"[A-Z]+(\d+)", ref)
-        ))
+        row_count = len({
+            int(m.group(1))
+            for m in map(_ROW_PREFIX_RE.match, cells)
+            if m
+        })
 
         # For small sheets, return all data (no RAG needed)
         if row_count <= settings.RAG_THRESHOLD_ROWS:
@@ -571,10 +786,8 @@ def _create_rag_tools():
 
         # Build the row content
         row_content = []
-        cell_pattern = re.compile(r"^([A-Z]+)(\d+)$")
-
         for cell_ref, value in cells.items():
-            match = cell_pattern.match(cell_ref)
+            match = _CELL_REF_RE.match(cell_ref)
             if match and int(match.group(2)) == row_number:
                 row_content.append(str(value))
 
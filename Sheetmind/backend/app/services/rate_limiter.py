@@ -16,6 +16,7 @@ Fallback behaviour (Redis down):
 import time
 import threading
 import logging
+from collections import OrderedDict
 
 import redis
 
@@ -201,6 +202,23 @@ AUTH_RATE_LIMITS = {
 }
 
 
+# ---------------------------------------------------------------------------
+# Per-worker leases on the shared auth counter
+# ---------------------------------------------------------------------------
+# Rather than one INCR per request, a worker reserves a block of an
+# (ip, action) budget from the shared Redis counter with a single INCRBY and
+# admits requests from that block locally. Every admitted request has been
+# counted in Redis first, so across all workers no more than the limit is
+# admitted per window; tokens a worker reserved but didn't use are simply
+# lost when the window ends (it errs on the side of admitting fewer).
+# Structure: {(ip, action): [tokens, window_index]} — LRU-bounded.
+
+_AUTH_LEASES_MAX = 100_000
+
+_auth_leases_lock = threading.Lock()
+_auth_leases: OrderedDict[tuple[str, str], list] = OrderedDict()
+
+
 def check_rate_limit_by_ip(ip: str, action: str = "signin") -> dict:
     """
     IP-based rate limiting for auth endpoints.
@@ -214,32 +232,52 @@ def check_rate_limit_by_ip(ip: str, action: str = "signin") -> dict:
         }
     """
     limit = AUTH_RATE_LIMITS.get(action, 10)
-    key = f"auth_rate:{action}:{ip}:{int(time.time()) // WINDOW_SECONDS}"
+    window = int(time.time()) // WINDOW_SECONDS
+    key = f"auth_rate:{action}:{ip}:{window}"
+    lease_key = (ip, action)
+
+    with _auth_leases_lock:
+        lease = _auth_leases.get(lease_key)
+        if lease is not None and lease[1] == window and lease[0] >= 1:
+            lease[0] -= 1
+            _auth_leases.move_to_end(lease_key)
+            return {"allowed": True, "limit": limit, "remaining": lease[0], "retry_after": None}
 
     r = _get_redis()
     if r is None:
         return _fallback_check(key, limit)
 
+    block = max(1, limit // max(1, settings.WORKERS))
     try:
         pipe = r.pipeline()
-        pipe.incr(key)
+        pipe.incrby(key, block)
         pipe.expire(key, WINDOW_SECONDS)
         results = pipe.execute()
 
-        current_count = results[0]
-        remaining = max(0, limit - current_count)
-        allowed = current_count <= limit
-
-        retry_after = None
-        if not allowed:
-            ttl = r.ttl(key)
-            retry_after = ttl if ttl > 0 else WINDOW_SECONDS
-
+        reserved = results[0]
+        # Only the part of this block that fits under the limit is usable
+        granted = min(block, limit - (reserved - block))
+        if granted >= 1:
+            with _auth_leases_lock:
+                lease = _auth_leases.get(lease_key)
+                spare = lease[0] if lease is not None and lease[1] == window else 0
+                _auth_leases[lease_key] = [spare + granted - 1, window]
+                _auth_leases.move_to_end(lease_key)
+                if len(_auth_leases) > _AUTH_LEASES_MAX:
+                    _auth_leases.popitem(last=False)
+            return {
+                "allowed": True,
+                "limit": limit,
+                "remaining": max(0, limit - reserved) + spare + granted - 1,
+                "retry_after": None,
+            }
+
+        ttl = r.ttl(key)
         return {
-            "allowed": allowed,
+            "allowed": False,
             "limit": limit,
-            "remaining": remaining,
-            "retry_after": retry_after,
+            "remaining": 0,
+            "retry_after": ttl if ttl > 0 else WINDOW_SECONDS,
         }
     except redis.exceptions.ConnectionError as e:
         global _redis_client, _redis_last_fail  # noqa: F811
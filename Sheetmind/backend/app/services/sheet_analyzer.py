@@ -5,12 +5,18 @@ Pre-processes spreadsheet data to extract structured metadata before the agent r
 This enables smarter, more accurate formula generation without guessing.
 """
 
+import hashlib
 import logging
 import re
+import threading
+import time
+from collections import Counter
 from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Any, Dict, List, Optional
 
+import orjson
+
 logger = logging.getLogger(__name__)
 
 
@@ -18,7 +24,7 @@ logger = logging.getLogger(__name__)
 # Data Models
 # ---------------------------------------------------------------------------
 
-@dataclass
+@dataclass(slots=True)
 class ColumnMetadata:
     """Metadata for a single column."""
     letter: str
@@ -61,7 +67,7 @@ class ColumnMetadata:
         return result
 
 
-@dataclass
+@dataclass(slots=True)
 class SheetMetadata:
     """Complete metadata for a spreadsheet."""
     sheet_name: str
@@ -102,27 +108,20 @@ DATE_PATTERNS = [
     r"^\w{3,9}\s+\d{1,2},?\s+\d{2,4}$",     # January 1, 2024
 ]
 
-_DATE_REGEX = [re.compile(p, re.IGNORECASE) for p in DATE_PATTERNS]
+# All date patterns as one alternation: a single match() call per value
+_DATE_RE = re.compile("|".join(f"(?:{p})" for p in DATE_PATTERNS), re.IGNORECASE)
 
+_CELL_REF_RE = re.compile(r"^([A-Z]+)(\d+)$")
 
-def _is_numeric(value: str) -> bool:
-    """Check if a value is numeric (including currency/percentage)."""
-    if not value or value.strip() == "":
-        return False
 
-    # Remove common formatting
-    cleaned = value.strip()
-    cleaned = cleaned.replace(",", "")
-    cleaned = cleaned.replace("$", "")
-    cleaned = cleaned.replace("%", "")
-    cleaned = cleaned.replace("(", "-").replace(")", "")  # Accounting format
-    cleaned = cleaned.strip()
+# Accounting/currency formatting stripped before parsing: "$1,200" -> "1200",
+# "(50)" -> "-50". One translate() call instead of a chain of replace()s.
+_NUMERIC_CLEAN = str.maketrans({",": None, "$": None, "%": None, "(": "-", ")": None})
 
-    try:
-        float(cleaned)
-        return True
-    except (ValueError, TypeError):
-        return False
+
+def _is_numeric(value: str) -> bool:
+    """Check if a value is numeric (including currency/percentage)."""
+    return _parse_numeric(value) is not None
 
 
 def _is_date(value: str) -> bool:
@@ -130,26 +129,17 @@ def _is_date(value: str) -> bool:
     if not value or value.strip() == "":
         return False
 
-    cleaned = value.strip()
-
-    for pattern in _DATE_REGEX:
-        if pattern.match(cleaned):
-            return True
-
-    return False
+    return _DATE_RE.match(value.strip()) is not None
 
 
 def _parse_numeric(value: str) -> Optional[float]:
     """Parse a numeric value, handling currency/percentage formatting."""
-    if not value or value.strip() == "":
+    if not value:
         return None
 
-    cleaned = value.strip()
-    cleaned = cleaned.replace(",", "")
-    cleaned = cleaned.replace("$", "")
-    cleaned = cleaned.replace("%", "")
-    cleaned = cleaned.replace("(", "-").replace(")", "")
-    cleaned = cleaned.strip()
+    cleaned = value.translate(_NUMERIC_CLEAN).strip()
+    if not cleaned:
+        return None
 
     try:
         return float(cleaned)
@@ -157,49 +147,56 @@ def _parse_numeric(value: str) -> Optional[float]:
         return None
 
 
-def _detect_column_type(values: List[str]) -> str:
-    """
-    Detect the predominant type of a column.
-
-    Returns: "numeric", "date", "categorical", "text", or "empty"
+def _classify_values(non_empty: List[str]) -> tuple[str, List[float]]:
     """
-    if not values:
-        return "empty"
+    Detect the predominant type of a column's non-empty values.
 
-    # Filter out empty values
-    non_empty = [v for v in values if v and str(v).strip()]
+    Each distinct value is parsed once — categorical columns repeat a few
+    values thousands of times. For numeric columns the parsed numbers are
+    returned (in row order) so stats don't parse the column again.
 
+    Returns: (type, numeric values) — type is "numeric", "date",
+    "categorical", "text", or "empty"; numeric values are empty unless
+    the type is "numeric".
+    """
     if not non_empty:
-        return "empty"
+        return "empty", []
 
     total = len(non_empty)
+    counts = Counter(non_empty)
+    parsed_by_value = {}
     numeric_count = 0
     date_count = 0
 
-    for val in non_empty:
+    for val, count in counts.items():
         val_str = str(val)
-        if _is_numeric(val_str):
-            numeric_count += 1
+        parsed = _parse_numeric(val_str)
+        parsed_by_value[val] = parsed
+        if parsed is not None:
+            numeric_count += count
         elif _is_date(val_str):
-            date_count += 1
+            date_count += count
 
     # Require 80% threshold for numeric
     if numeric_count / total >= 0.8:
-        return "numeric"
+        numeric_vals = [
+            parsed for parsed in map(parsed_by_value.__getitem__, non_empty)
+            if parsed is not None
+        ]
+        return "numeric", numeric_vals
 
     # Require 50% threshold for date
     if date_count / total >= 0.5:
-        return "date"
+        return "date", []
 
     # Check for categorical (low cardinality text)
-    unique_values = set(non_empty)
-    unique_ratio = len(unique_values) / total
+    unique_ratio = len(counts) / total
 
     # If less than 30% unique values and fewer than 20 categories, it's categorical
-    if unique_ratio < 0.3 and len(unique_values) <= 20:
-        return "categorical"
+    if unique_ratio < 0.3 and len(counts) <= 20:
+        return "categorical", []
 
-    return "text"
+    return "text", []
 
 
 # ---------------------------------------------------------------------------
@@ -230,15 +227,13 @@ def analyze_sheet(cells: Dict[str, str], sheet_name: str = "Sheet1") -> SheetMet
         )
 
     # Parse cell references to extract structure
-    cell_pattern = re.compile(r"^([A-Z]+)(\d+)$")
-
     # Organize data by column
     column_data: Dict[str, Dict[int, str]] = {}  # column_letter -> {row: value}
     all_rows = set()
     all_cols = set()
 
     for ref, value in cells.items():
-        match = cell_pattern.match(ref)
+        match = _CELL_REF_RE.match(ref)
         if not match:
             continue
 
@@ -281,17 +276,13 @@ def analyze_sheet(cells: Dict[str, str], sheet_name: str = "Sheet1") -> SheetMet
         header = col_rows.get(min_row, col_rows.get(1, f"Column {col_letter}"))
 
         # Get data values (excluding header)
-        data_values = [
-            col_rows.get(r, "")
-            for r in range(min_row + 1, max_row + 1)
-            if r in col_rows or r <= max_row
-        ]
+        data_values = [col_rows.get(r, "") for r in range(min_row + 1, max_row + 1)]
+        non_empty_values = [v for v in data_values if v and v.strip()]
 
-        # Detect column type
-        col_type = _detect_column_type(data_values)
+        # Detect column type (numbers are parsed once, reused for stats below)
+        col_type, numeric_vals = _classify_values(non_empty_values)
 
         # Calculate statistics
-        non_empty_values = [v for v in data_values if v and str(v).strip()]
         unique_values = list(set(non_empty_values))
         null_count = len(data_values) - len(non_empty_values)
 
@@ -307,17 +298,12 @@ def analyze_sheet(cells: Dict[str, str], sheet_name: str = "Sheet1") -> SheetMet
 
         # Calculate numeric stats
         if col_type == "numeric":
-            numeric_vals = []
-            for v in non_empty_values:
-                parsed = _parse_numeric(v)
-                if parsed is not None:
-                    numeric_vals.append(parsed)
-
             if numeric_vals:
+                total = sum(numeric_vals)
                 col_meta.min_value = min(numeric_vals)
                 col_meta.max_value = max(numeric_vals)
-                col_meta.avg_value = sum(numeric_vals) / len(numeric_vals)
-                col_meta.sum_value = sum(numeric_vals)
+                col_meta.avg_value = total / len(numeric_vals)
+                col_meta.sum_value = total
 
             # Numeric columns are good for aggregation
             suggested_aggregate.append(col_letter)
@@ -352,6 +338,49 @@ def analyze_sheet(cells: Dict[str, str], sheet_name: str = "Sheet1") -> SheetMet
     )
 
 
+# ---------------------------------------------------------------------------
+# Metadata Cache
+# ---------------------------------------------------------------------------
+# Follow-up messages in a conversation usually resend the same sheet, and the
+# SmartExecutor -> ReAct fallback analyzes it twice in one request. The result
+# depends only on (cells, sheet_name), so it is cached by a content hash.
+# Cached SheetMetadata objects are shared: callers must treat them as read-only.
+
+_METADATA_CACHE_TTL = 300  # 5 minutes
+_METADATA_CACHE_MAX = 256  # entries per worker
+
+_metadata_cache_lock = threading.Lock()
+_metadata_cache: dict[tuple[str, bytes], tuple[float, SheetMetadata]] = {}
+
+
+def cells_digest(cells: Dict[str, Any]) -> bytes:
+    """Order-independent digest of a cells dict."""
+    payload = orjson.dumps(cells, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+
+def analyze_sheet_cached(cells: Dict[str, str], sheet_name: str = "Sheet1") -> SheetMetadata:
+    """analyze_sheet() with a per-worker TTL cache keyed by sheet content."""
+    try:
+        key = (sheet_name, cells_digest(cells))
+    except (TypeError, orjson.JSONEncodeError):
+        return analyze_sheet(cells, sheet_name)
+
+    now = time.monotonic()
+    with _metadata_cache_lock:
+        entry = _metadata_cache.get(key)
+    if entry is not None and now - entry[0] <= _METADATA_CACHE_TTL:
+        return entry[1]
+
+    metadata = analyze_sheet(cells, sheet_name)
+    with _metadata_cache_lock:
+        _metadata_cache.pop(key, None)
+        if len(_metadata_cache) >= _METADATA_CACHE_MAX:
+            _metadata_cache.pop(next(iter(_metadata_cache)))
+        _metadata_cache[key] = (now, metadata)
+    return metadata
+
+
 def format_metadata_for_prompt(metadata: SheetMetadata) -> str:
     """
     Format sheet metadata as a string for inclusion in the agent prompt.
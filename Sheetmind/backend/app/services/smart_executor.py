@@ -33,7 +33,7 @@ class RequestType(str, Enum):
     COMPLEX = "complex"                      # Custom - use plan+execute
 
 
-@dataclass
+@dataclass(slots=True)
 class ClassifiedRequest:
     """Result of classifying a user request."""
     request_type: RequestType
@@ -420,13 +420,11 @@ class SmartExecutor:
         # Format conversation history (last 3 exchanges, 200 chars each)
         history_str = "No prior conversation."
         if history:
-            recent = history[-6:]  # last 3 exchanges (6 messages)
-            lines = []
-            for msg in recent:
-                role = msg.get("role", "unknown")
-                content = msg.get("content", "")[:200]
-                lines.append(f"{role}: {content}")
-            history_str = "\n".join(lines)
+            # last 3 exchanges (6 messages)
+            history_str = "\n".join([
+                f"{msg.get('role', 'unknown')}: {msg.get('content', '')[:200]}"
+                for msg in history[-6:]
+            ])
 
         # Build data sample from first 5 data rows
         data_sample_str = "No cell data available."
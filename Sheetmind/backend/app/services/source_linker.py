@@ -1,30 +1,33 @@
 """
 Source Linker — extracts row/cell references from AI responses
-and converts them into structured SourceReference objects for
+and converts them into structured SourceReference dicts for
 click-to-verify navigation in the Google Sheets sidebar.
 """
 
 import logging
 import re
+
 from app.schemas.message import SourceReference
 
 logger = logging.getLogger(__name__)
 
 
-# Patterns to detect spreadsheet references in AI text
+# Patterns to detect spreadsheet references in AI text, compiled once.
+# The middle field is a substring every match must contain, so a pattern
+# is only run over responses that could possibly match it.
 PATTERNS = [
     # "Rows 45-67" or "rows 12-18"
-    (r'[Rr]ows?\s+(\d+)\s*[-–to]+\s*(\d+)', 'row_range'),
+    (re.compile(r'[Rr]ows?\s+(\d+)\s*[-–to]+\s*(\d+)'), 'ow', 'row_range'),
     # "Row 5" or "row 12"
-    (r'[Rr]ow\s+(\d+)(?!\s*[-–to])', 'single_row'),
+    (re.compile(r'[Rr]ow\s+(\d+)(?!\s*[-–to])'), 'ow', 'single_row'),
     # "Sheet1!A2:B50"
-    (r'(\w+)!([A-Z]+\d+):([A-Z]+\d+)', 'sheet_range'),
+    (re.compile(r'(\w+)!([A-Z]+\d+):([A-Z]+\d+)'), '!', 'sheet_range'),
     # "Range A1:D10" or "range B2:C5"
-    (r'[Rr]ange\s+([A-Z]+\d+):([A-Z]+\d+)', 'range'),
+    (re.compile(r'[Rr]ange\s+([A-Z]+\d+):([A-Z]+\d+)'), 'ange', 'range'),
     # "Cell B3" or "cell A1"
-    (r'[Cc]ell\s+([A-Z]+\d+)', 'single_cell'),
+    (re.compile(r'[Cc]ell\s+([A-Z]+\d+)'), 'ell', 'single_cell'),
     # Standalone range like "A1:D10" (not already captured)
-    (r'(?<![A-Za-z!])([A-Z]+\d+):([A-Z]+\d+)', 'bare_range'),
+    (re.compile(r'(?<![A-Za-z!])([A-Z]+\d+):([A-Z]+\d+)'), ':', 'bare_range'),
 ]
 
 
@@ -40,17 +43,20 @@ def extract_sources(
         default_sheet: Sheet name to use when not specified in the reference.
 
     Returns:
-        List of SourceReference objects with label, sheet, and range.
+        List of SourceReference dicts with label, sheet, and range,
+        ready to return in a JSON response.
     """
     sources: list[SourceReference] = []
     seen: set[str] = set()  # Deduplicate
 
-    for pattern, ref_type in PATTERNS:
+    for pattern, required, ref_type in PATTERNS:
+        if required not in response_text:
+            continue
         try:
-            for match in re.finditer(pattern, response_text):
+            for match in pattern.finditer(response_text):
                 source = _match_to_source(match, ref_type, default_sheet)
-                if source and source.range not in seen:
-                    seen.add(source.range)
+                if source and source["range"] not in seen:
+                    seen.add(source["range"])
                     sources.append(source)
         except (ValueError, IndexError, re.error) as e:
             logger.warning(f"Source extraction failed for pattern {ref_type}: {e}")
@@ -0,0 +1,36 @@
+-- Migration: Single round-trip user upsert for auth
+-- Replaces the SELECT-then-INSERT pair in /auth/signin and /auth/callback,
+-- which cost two PostgREST round-trips per login and raced under concurrent
+-- logins from the same user.
+--
+-- Run this in the Supabase SQL Editor (Dashboard > SQL Editor > New query).
+
+-- Insert the user if missing (never overwriting an existing row — tier and
+-- profile fields are owned by billing/profile code), then return the row.
+-- ON CONFLICT DO NOTHING waits for any concurrent insert of the same id, so
+-- the SELECT always sees exactly one committed row.
+CREATE OR REPLACE FUNCTION ensure_user(
+    p_id UUID,
+    p_email TEXT,
+    p_name TEXT,
+    p_google_id TEXT DEFAULT NULL,
+    p_avatar_url TEXT DEFAULT NULL
+)
+RETURNS SETOF users
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    INSERT INTO users (id, email, name, google_id, avatar_url, tier)
+    VALUES (p_id, p_email, p_name, p_google_id, p_avatar_url, 'free')
+    ON CONFLICT (id) DO NOTHING;
+
+    RETURN QUERY SELECT * FROM users WHERE id = p_id;
+END;
+$$;
+
+-- Callable by the backend's service role only: as SECURITY DEFINER it
+-- trusts p_id, so clients must not reach it through PostgREST.
+REVOKE EXECUTE ON FUNCTION ensure_user(UUID, TEXT, TEXT, TEXT, TEXT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION ensure_user(UUID, TEXT, TEXT, TEXT, TEXT) TO service_role;
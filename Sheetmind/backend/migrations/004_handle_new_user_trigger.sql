@@ -0,0 +1,45 @@
+-- Migration: Mirror new auth users into public.users via trigger
+-- /auth/signup used to follow client.auth.sign_up() with a second round-trip
+-- inserting into public.users, which frequently hit duplicates. Creating the
+-- row inside the same transaction as the auth.users insert removes that call
+-- and covers Google sign-ups too.
+--
+-- Run this in the Supabase SQL Editor (Dashboard > SQL Editor > New query).
+
+-- Column values match what /auth/signin, /auth/callback and get_current_user
+-- insert, so rows look the same regardless of which path created them.
+CREATE OR REPLACE FUNCTION public.handle_new_user()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    INSERT INTO public.users (id, email, name, google_id, avatar_url, tier)
+    VALUES (
+        NEW.id,
+        COALESCE(NEW.email, ''),
+        COALESCE(
+            NEW.raw_user_meta_data->>'full_name',
+            NEW.raw_user_meta_data->>'name',
+            split_part(NEW.email, '@', 1)
+        ),
+        COALESCE(
+            NEW.raw_user_meta_data->>'provider_id',
+            NEW.raw_user_meta_data->>'sub'
+        ),
+        COALESCE(
+            NEW.raw_user_meta_data->>'avatar_url',
+            NEW.raw_user_meta_data->>'picture'
+        ),
+        'free'
+    )
+    ON CONFLICT (id) DO NOTHING;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS on_auth_user_created ON auth.users;
+CREATE TRIGGER on_auth_user_created
+    AFTER INSERT ON auth.users
+    FOR EACH ROW EXECUTE FUNCTION public.handle_new_user();
@@ -0,0 +1,50 @@
+-- Migration: Single round-trip chat persistence
+-- Replaces the four PostgREST calls made by _persist_chat after every chat
+-- reply (verify conversation, insert user message, insert assistant message,
+-- touch conversations.updated_at), each of which held a background thread
+-- for a full network round-trip.
+--
+-- Run this in the Supabase SQL Editor (Dashboard > SQL Editor > New query).
+
+-- Returns FALSE (and writes nothing) if the conversation doesn't exist or
+-- belongs to another user, TRUE once both messages are stored.
+-- created_at is set with clock_timestamp() per INSERT so the user message
+-- sorts strictly before the reply; now() would give both the same value.
+CREATE OR REPLACE FUNCTION persist_chat(
+    p_conversation_id UUID,
+    p_user_id UUID,
+    p_user_message TEXT,
+    p_ai_response TEXT,
+    p_confidence_score DOUBLE PRECISION DEFAULT NULL,
+    p_sources JSONB DEFAULT '[]'::jsonb
+)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    PERFORM 1 FROM conversations
+    WHERE id = p_conversation_id AND user_id = p_user_id
+    FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN FALSE;
+    END IF;
+
+    INSERT INTO messages (conversation_id, role, content, created_at)
+    VALUES (p_conversation_id, 'user', p_user_message, clock_timestamp());
+
+    INSERT INTO messages (conversation_id, role, content, confidence_score, sources, created_at)
+    VALUES (p_conversation_id, 'assistant', p_ai_response, p_confidence_score, p_sources, clock_timestamp());
+
+    UPDATE conversations SET updated_at = now() WHERE id = p_conversation_id;
+
+    RETURN TRUE;
+END;
+$$;
+
+-- Callable by the backend's service role only: as SECURITY DEFINER it
+-- trusts the user ids it is given, so clients must not reach it through
+-- PostgREST.
+REVOKE EXECUTE ON FUNCTION persist_chat(UUID, UUID, TEXT, TEXT, DOUBLE PRECISION, JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION persist_chat(UUID, UUID, TEXT, TEXT, DOUBLE PRECISION, JSONB) TO service_role;
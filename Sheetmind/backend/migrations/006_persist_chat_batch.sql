@@ -0,0 +1,44 @@
+-- Migration: Batched chat persistence
+-- The backend queues chat replies and flushes them together (see
+-- app/services/persist_queue.py), so a burst of N replies costs one
+-- PostgREST round-trip instead of N persist_chat calls.
+--
+-- Requires 005_persist_chat.sql.
+-- Run this in the Supabase SQL Editor (Dashboard > SQL Editor > New query).
+
+-- p_rows is a JSON array of objects with keys conversation_id, user_id,
+-- user_message, ai_response, confidence_score, sources. Rows are stored in
+-- array order, so exchanges of the same conversation keep their sequence.
+-- Returns how many rows were stored; rows whose conversation is missing or
+-- belongs to another user are skipped, as persist_chat does.
+CREATE OR REPLACE FUNCTION persist_chat_batch(p_rows JSONB)
+RETURNS INTEGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    r JSONB;
+    stored INTEGER := 0;
+BEGIN
+    FOR r IN SELECT value FROM jsonb_array_elements(p_rows) WITH ORDINALITY ORDER BY ordinality
+    LOOP
+        IF persist_chat(
+            (r->>'conversation_id')::UUID,
+            (r->>'user_id')::UUID,
+            r->>'user_message',
+            r->>'ai_response',
+            (r->>'confidence_score')::DOUBLE PRECISION,
+            COALESCE(r->'sources', '[]'::jsonb)
+        ) THEN
+            stored := stored + 1;
+        END IF;
+    END LOOP;
+
+    RETURN stored;
+END;
+$$;
+
+-- Backend (service role) only, like persist_chat.
+REVOKE EXECUTE ON FUNCTION persist_chat_batch(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION persist_chat_batch(JSONB) TO service_role;
@@ -0,0 +1,85 @@
+-- Migration: Create the conversation in the same call that stores the turn
+-- The first message of a chat used to POST /conversations before the reply
+-- could be returned (to learn the new id), then persist the messages in a
+-- separate call. The backend now picks the conversation id itself and
+-- passes the title along with the first exchange, so a new conversation
+-- costs no extra round-trip and the response never waits on it.
+--
+-- Requires 005_persist_chat.sql.
+-- Run this in the Supabase SQL Editor (Dashboard > SQL Editor > New query).
+
+-- Same as persist_chat, except that a conversation with p_conversation_id
+-- that doesn't exist yet is created for p_user_id first. ON CONFLICT DO
+-- NOTHING plus the ownership check means an id that already belongs to
+-- another user is still rejected (returns FALSE).
+-- p_title is only sent with the first exchange. Follow-ups may create the
+-- conversation too (titled from their own message) so that losing the first
+-- write doesn't silently drop every later turn of the conversation.
+CREATE OR REPLACE FUNCTION persist_chat_turn(
+    p_conversation_id UUID,
+    p_user_id UUID,
+    p_user_message TEXT,
+    p_ai_response TEXT,
+    p_confidence_score DOUBLE PRECISION DEFAULT NULL,
+    p_sources JSONB DEFAULT '[]'::jsonb,
+    p_title TEXT DEFAULT NULL
+)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    INSERT INTO conversations (id, user_id, title)
+    VALUES (p_conversation_id, p_user_id, COALESCE(p_title, LEFT(p_user_message, 100)))
+    ON CONFLICT (id) DO NOTHING;
+
+    RETURN persist_chat(
+        p_conversation_id, p_user_id, p_user_message,
+        p_ai_response, p_confidence_score, p_sources
+    );
+END;
+$$;
+
+-- Backend (service role) only, like persist_chat.
+REVOKE EXECUTE ON FUNCTION persist_chat_turn(UUID, UUID, TEXT, TEXT, DOUBLE PRECISION, JSONB, TEXT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION persist_chat_turn(UUID, UUID, TEXT, TEXT, DOUBLE PRECISION, JSONB, TEXT) TO service_role;
+
+-- Batched variant used by the persist queue: persist_chat_batch with rows
+-- that may carry a "title" key (absent or null for follow-up messages), and
+-- that create their conversation if it is missing, as persist_chat_turn does.
+-- A new name rather than a redefinition, so a backend talking to a database
+-- without this migration gets a 404 and falls back to per-row writes
+-- (which create the conversation over REST) instead of dropping rows.
+CREATE OR REPLACE FUNCTION persist_chat_turn_batch(p_rows JSONB)
+RETURNS INTEGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    r JSONB;
+    stored INTEGER := 0;
+BEGIN
+    FOR r IN SELECT value FROM jsonb_array_elements(p_rows) WITH ORDINALITY ORDER BY ordinality
+    LOOP
+        IF persist_chat_turn(
+            (r->>'conversation_id')::UUID,
+            (r->>'user_id')::UUID,
+            r->>'user_message',
+            r->>'ai_response',
+            (r->>'confidence_score')::DOUBLE PRECISION,
+            COALESCE(r->'sources', '[]'::jsonb),
+            r->>'title'
+        ) THEN
+            stored := stored + 1;
+        END IF;
+    END LOOP;
+
+    RETURN stored;
+END;
+$$;
+
+-- Backend (service role) only, like persist_chat.
+REVOKE EXECUTE ON FUNCTION persist_chat_turn_batch(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION persist_chat_turn_batch(JSONB) TO service_role;
@@ -33,6 +33,195 @@ def test_root_redirects_or_responds():
     assert response.status_code in [200, 307, 404]
 
 
+
+def test_large_responses_are_gzipped():
+    """Test that responses above the size threshold are gzip-compressed."""
+    response = client.get("/openapi.json", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers.get("content-encoding") == "gzip"
+
+    small = client.get("/api/health", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+
+
+# =============================================================================
+# Auth Tests
+# =============================================================================
+
+def test_oauth_complete_page():
+    """Test that the OAuth completion page is served with its CSP header."""
+    response = client.get("/api/auth/oauth-complete")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/html")
+    assert "connect-src 'self'" in response.headers["content-security-policy"]
+    assert "sheetmind-oauth" in response.text
+    assert "/\\+/g" in response.text
+
+
+def test_oauth_complete_page_gzip():
+    """Test that the precompressed page is only sent to gzip-capable clients."""
+    gz = client.get("/api/auth/oauth-complete", headers={"Accept-Encoding": "gzip"})
+    plain = client.get("/api/auth/oauth-complete", headers={"Accept-Encoding": "identity"})
+
+    assert gz.headers["content-encoding"] == "gzip"
+    assert "content-encoding" not in plain.headers
+    assert gz.text == plain.text
+    assert "Accept-Encoding" in gz.headers["vary"]
+    assert "Accept-Encoding" in plain.headers["vary"]
+
+
+def test_oauth_complete_page_head():
+    """Test that HEAD returns the page headers without a body."""
+    response = client.head("/api/auth/oauth-complete")
+    assert response.status_code == 200
+    assert response.content == b""
+    assert "immutable" in response.headers["cache-control"]
+
+
+def test_login_url():
+    """Test that the OAuth login URL carries PKCE params and the nonce redirect."""
+    from urllib.parse import parse_qs, urlparse
+
+    response = client.get("/api/auth/login", params={"nonce": "abc123"})
+    assert response.status_code == 200
+    query = parse_qs(urlparse(response.json()["url"]).query)
+
+    assert query["provider"] == ["google"]
+    assert query["code_challenge_method"] == ["S256"]
+    assert len(query["code_challenge"][0]) == 43
+    assert query["redirect_to"] == ["http://testserver/api/auth/oauth-complete?nonce=abc123"]
+
+
+def test_auth_rate_limit_is_shared_across_workers(monkeypatch):
+    """Test that blocks reserved by several workers never admit more than the limit."""
+    from collections import OrderedDict
+    import app.services.rate_limiter as rate_limiter
+    from app.core.database import get_supabase_anon
+
+    class FakeRedis:
+        def __init__(self):
+            self.counts = {}
+
+        def pipeline(self):
+            redis_ = self
+            ops = []
+
+            class Pipe:
+                def incrby(self, key, amount):
+                    ops.append((key, amount))
+
+                def expire(self, key, seconds):
+                    pass
+
+                def execute(self):
+                    results = []
+                    for key, amount in ops:
+                        redis_.counts[key] = redis_.counts.get(key, 0) + amount
+                        results.append(redis_.counts[key])
+                    return results + [True]
+
+            return Pipe()
+
+        def ttl(self, key):
+            return 42
+
+    class FakeAuth:
+        def sign_in_with_password(self, credentials):
+            raise Exception("Invalid login credentials")
+
+    class FakeClient:
+        auth = FakeAuth()
+
+    redis_ = FakeRedis()
+    monkeypatch.setattr(rate_limiter, "_get_redis", lambda: redis_)
+    app.dependency_overrides[get_supabase_anon] = lambda: FakeClient()
+    limit = rate_limiter.AUTH_RATE_LIMITS["signin"]
+
+    def signin_statuses(ip, workers, attempts):
+        statuses = []
+        for i in range(attempts):
+            # Each worker keeps its own leases; all reserve from one counter
+            monkeypatch.setattr(rate_limiter, "_auth_leases", workers[i % len(workers)])
+            response = client.post(
+                "/api/auth/signin",
+                json={"email": "a@example.com", "password": "wrong-password"},
+                headers={"X-Forwarded-For": ip},
+            )
+            statuses.append(response.status_code)
+        return statuses
+
+    try:
+        one_worker = signin_statuses("203.0.113.7", [OrderedDict()], limit + 1)
+        two_workers = signin_statuses("203.0.113.8", [OrderedDict(), OrderedDict()], 2 * limit)
+    finally:
+        app.dependency_overrides.pop(get_supabase_anon, None)
+
+    assert one_worker == [401] * limit + [429]
+    # Tokens left in another worker's lease are lost, never admitted twice
+    assert two_workers.count(401) <= limit
+    assert two_workers.count(429) >= limit
+
+
+def test_refresh_coalesces_concurrent_calls():
+    """Test that concurrent refreshes of one token share a single upstream call."""
+    import asyncio
+    import time
+    from types import SimpleNamespace
+    from app.api.routes.auth import _refresh_inflight, _refresh_session_coalesced
+
+    calls = []
+
+    def refresh_session(token):
+        calls.append(token)
+        time.sleep(0.05)
+        return f"session-for-{token}"
+
+    fake = SimpleNamespace(auth=SimpleNamespace(refresh_session=refresh_session))
+
+    async def burst():
+        return await asyncio.gather(
+            *(_refresh_session_coalesced(fake, "rt-1") for _ in range(5)),
+            _refresh_session_coalesced(fake, "rt-2"),
+        )
+
+    results = asyncio.run(burst())
+
+    assert results == ["session-for-rt-1"] * 5 + ["session-for-rt-2"]
+    assert sorted(calls) == ["rt-1", "rt-2"]
+    assert _refresh_inflight == {}
+
+
+def test_refresh_survives_leader_cancellation():
+    """Test that a waiter still gets the rotated session when the first caller disconnects."""
+    import asyncio
+    import time
+    from types import SimpleNamespace
+    from app.api.routes.auth import _refresh_inflight, _refresh_session_coalesced
+
+    calls = []
+
+    def refresh_session(token):
+        calls.append(token)
+        time.sleep(0.05)
+        return f"session-for-{token}"
+
+    fake = SimpleNamespace(auth=SimpleNamespace(refresh_session=refresh_session))
+
+    async def run():
+        leader = asyncio.create_task(_refresh_session_coalesced(fake, "rt-1"))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(_refresh_session_coalesced(fake, "rt-1"))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == "session-for-rt-1"
+    assert calls == ["rt-1"]
+    assert _refresh_inflight == {}
+
+
 # =============================================================================
 # Sheet Analyzer Tests
 # =============================================================================
@@ -89,6 +278,18 @@ def test_sheet_analyzer_empty_data():
     assert len(metadata.columns) == 0
 
 
+def test_sheet_analyzer_cache_keyed_by_content():
+    """Test that cached metadata is reused only for identical sheet content."""
+    from app.services.sheet_analyzer import analyze_sheet_cached
+
+    cells = {'A1': 'Name', 'B1': 'Amount', 'A2': 'John', 'B2': '100'}
+    first = analyze_sheet_cached(cells, 'Cached')
+
+    assert analyze_sheet_cached(dict(reversed(cells.items())), 'Cached') is first
+    assert analyze_sheet_cached({**cells, 'B3': '5'}, 'Cached') is not first
+    assert analyze_sheet_cached(cells, 'Other').sheet_name == 'Other'
+
+
 # =============================================================================
 # SmartExecutor Tests
 # =============================================================================
@@ -159,6 +360,19 @@ def test_detect_agent_intent():
     assert detect_agent_intent("what is the weather") == False
 
 
+def test_detect_agent_intent_followup():
+    """Test that short confirmations inherit agent intent from history."""
+    from app.api.routes.chat import detect_agent_intent, is_simple_greeting
+
+    history = [{"role": "user", "content": "sum of sales by region"}]
+    assert detect_agent_intent("yes, do it!", history) == False
+    assert detect_agent_intent("  Go ahead! ", history) == True
+    assert detect_agent_intent("go ahead", [{"role": "user", "content": "hello"}]) == False
+
+    assert is_simple_greeting("  Hello! ") == True
+    assert is_simple_greeting("hello there") == False
+
+
 def test_detect_chart_intent():
     """Test chart intent detection."""
     from app.api.routes.chat import detect_chart_intent
@@ -174,6 +388,745 @@ def test_detect_chart_intent():
     assert detect_chart_intent("count the rows") == False
 
 
+def test_request_limits_are_not_fields():
+    """MAX_* limits are class constants: not in the schema, not settable by clients."""
+    from pydantic import ValidationError
+    from app.api.routes.chart import ChartRequest
+    from app.schemas.message import ChatRequest
+
+    for model in (ChartRequest, ChatRequest):
+        assert not any(name.startswith("MAX_") for name in model.model_fields)
+
+    req = ChartRequest(data={"values": [1, 2]}, MAX_DATA_BYTES=1)
+    assert ChartRequest.MAX_DATA_BYTES == 5_000_000
+    assert req.data == {"values": [1, 2]}
+
+    try:
+        ChartRequest(data={}, title="x" * (ChartRequest.MAX_TITLE_LENGTH + 1))
+        assert False, "oversized title should be rejected"
+    except ValidationError:
+        pass
+
+
+def test_chart_endpoint_returns_response_model_fields(monkeypatch):
+    """Test that /chat/chart's plain-dict response is shaped by ChartResponse."""
+    import app.api.routes.chart as chart
+    from app.core.auth import get_current_user
+
+    monkeypatch.setattr(chart, "_check_limits", lambda user: None)
+    monkeypatch.setattr(chart, "get_cached", lambda **kwargs: {
+        "chart_config": {"type": "bar"}, "chart_type": "bar", "extra": "dropped",
+    })
+    app.dependency_overrides[get_current_user] = lambda: {"id": "u1", "tier": "pro"}
+    try:
+        response = client.post("/api/chat/chart", json={"data": {"values": [1, 2]}})
+    finally:
+        app.dependency_overrides.pop(get_current_user)
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "chart_config": {"type": "bar"}, "chart_type": "bar",
+        "confidence_score": None, "confidence_tier": None,
+    }
+
+
+def test_chat_request_rejects_oversized_sheet_before_field_validation():
+    """Sheet size limits are checked on the raw payload."""
+    from pydantic import ValidationError
+    from app.schemas.message import ChatRequest
+
+    cells = {f"A{i}": "x" for i in range(ChatRequest.MAX_SHEET_CELLS + 1)}
+    try:
+        ChatRequest(message="hi", sheet_data={"cells": cells})
+        assert False, "oversized sheet should be rejected"
+    except ValidationError as e:
+        assert "Sheet data too large" in str(e)
+
+    req = ChatRequest(message="hi", sheet_data={"cells": {"A1": "x"}})
+    assert req.sheet_data == {"cells": {"A1": "x"}}
+
+
+def test_chat_request_truncates_history_before_validating():
+    """Only the kept (most recent) history messages are validated."""
+    from app.schemas.message import ChatRequest
+
+    keep = ChatRequest.MAX_HISTORY_LENGTH
+    history = [{"role": "user"}] + [{"role": "user", "content": str(i)} for i in range(keep)]
+    req = ChatRequest(message="hi", history=history)
+    assert len(req.history) == keep
+    assert req.history[-1].content == str(keep - 1)
+
+
+def test_generate_quick_actions():
+    """Test that quick actions pick up numeric and categorical columns."""
+    from app.api.routes.chat import _generate_quick_actions
+
+    cells = {"A1": "Region", "B1": "Sales", "c1": "ignored", "B": "ignored"}
+    for row in range(2, 40):
+        cells[f"A{row}"] = ["North", "South"][row % 2]
+        cells[f"B{row}"] = f"${row * 10:,}"
+
+    labels = [a["label"] for a in _generate_quick_actions({"cells": cells}, "Data")]
+
+    assert labels[0] == "Sum Sales by Region"
+    assert "Total Sales" in labels
+    assert labels[-1] == "Find Duplicates"
+    assert _generate_quick_actions({"cells": {}}, None) == []
+
+
+def test_generate_quick_actions_cached_by_content(monkeypatch):
+    """Test that quick actions are reused for identical sheets and refreshed on request."""
+    import app.api.routes.chat as chat
+
+    cells = {"A1": "Region", "B1": "Sales", "A2": "North", "B2": "10", "A3": "North", "B3": "20"}
+    calls = []
+    original = chat._generate_quick_actions
+
+    def counting(sheet_data, sheet_name):
+        calls.append(sheet_name)
+        return original(sheet_data, sheet_name)
+
+    monkeypatch.setattr(chat, "_quick_actions_cache", {})
+    monkeypatch.setattr(chat, "_generate_quick_actions", counting)
+    first = chat._generate_quick_actions_cached({"cells": cells}, "Data")
+    again = chat._generate_quick_actions_cached({"cells": dict(reversed(cells.items()))}, "Data")
+    chat._generate_quick_actions_cached({"cells": cells}, "Data", refresh=True)
+
+    assert [a["label"] for a in again] == [a["label"] for a in first]
+    assert calls == ["Data", "Data"]
+
+
+def test_persist_chat_uses_single_rpc(monkeypatch):
+    """Test that chat persistence is one async persist_chat_turn RPC call."""
+    import asyncio
+    import orjson
+    from types import SimpleNamespace
+    import app.api.routes.chat as chat
+
+    calls = []
+
+    class FakePostgrest:
+        async def post(self, path, content, headers):
+            calls.append((path, orjson.loads(content)))
+            return SimpleNamespace(is_success=True, json=lambda: True)
+
+    class NoRestSupabase:
+        def table(self, name):
+            raise AssertionError("REST fallback should not run")
+
+    monkeypatch.setattr(chat, "get_postgrest_async", lambda: FakePostgrest())
+    asyncio.run(chat._persist_chat(NoRestSupabase(), "conv-1", "user-1", "hi", "hello", 0.9, [], "New chat"))
+
+    assert [path for path, _ in calls] == ["/rpc/persist_chat_turn"]
+    assert calls[0][1]["p_ai_response"] == "hello"
+    assert calls[0][1]["p_title"] == "New chat"
+
+
+def test_persist_followup_creates_conversation_lost_on_first_write():
+    """Test that a follow-up whose first exchange was never stored still creates the conversation."""
+    from types import SimpleNamespace
+    import app.api.routes.chat as chat
+
+    rows = {"conversations": [], "messages": []}
+
+    class FakeQuery:
+        def __init__(self, name):
+            self.name, self.pending = name, None
+
+        def select(self, *_):
+            return self
+
+        def eq(self, *_):
+            return self
+
+        def insert(self, row):
+            self.pending = row
+            return self
+
+        def update(self, *_):
+            return self
+
+        def execute(self):
+            if self.pending is not None:
+                rows[self.name].append(self.pending)
+                return SimpleNamespace(data=[self.pending])
+            return SimpleNamespace(data=list(rows[self.name]))
+
+    sb = SimpleNamespace(table=FakeQuery)
+    message = "and what about March? " * 10
+    chat._persist_chat_fallback(sb, "conv-1", "user-1", message, "March was up.", 0.8, [], None)
+
+    assert rows["conversations"] == [{"id": "conv-1", "user_id": "user-1", "title": message[:100]}]
+    assert [m["role"] for m in rows["messages"]] == ["user", "assistant"]
+
+
+def test_persist_queue_batches_rows(monkeypatch):
+    """Test that queued chat rows are flushed together, with per-row fallback on failure."""
+    import asyncio
+    import orjson
+    from types import SimpleNamespace
+    import app.services.persist_queue as pq
+
+    batches, fallback_rows = [], []
+
+    class FakePostgrest:
+        ok = True
+
+        async def post(self, path, content, headers):
+            rows = orjson.loads(content)["p_rows"]
+            batches.append((path, rows))
+            return SimpleNamespace(is_success=self.ok, status_code=200 if self.ok else 404,
+                                   json=lambda: len(rows))
+
+    fake = FakePostgrest()
+    monkeypatch.setattr(pq, "get_postgrest_async", lambda: fake)
+
+    async def fallback(row):
+        fallback_rows.append(row)
+
+    async def run():
+        pq.start_persist_worker(fallback)
+        for i in range(3):
+            assert pq.enqueue_chat({"conversation_id": "c", "user_message": str(i)})
+        await pq.stop_persist_worker()
+
+        fake.ok = False
+        pq.start_persist_worker(fallback)
+        pq.enqueue_chat({"conversation_id": "c", "user_message": "x"})
+        await pq.stop_persist_worker()
+
+    asyncio.run(run())
+
+    assert batches[0] == ("/rpc/persist_chat_turn_batch", [
+        {"conversation_id": "c", "user_message": str(i)} for i in range(3)
+    ])
+    assert fallback_rows == [{"conversation_id": "c", "user_message": "x"}]
+    assert not pq.enqueue_chat({"conversation_id": "c"})
+
+
+def test_fetch_db_history_queries_postgrest(monkeypatch):
+    """Test that DB history is read through the async PostgREST client."""
+    import asyncio
+    from types import SimpleNamespace
+    import app.api.routes.chat as chat
+
+    requests = []
+    rows = [{"role": "user", "content": "hi", "id": 1}, {"role": "assistant", "content": "hello", "id": 2}]
+
+    class FakePostgrest:
+        async def get(self, path, params):
+            requests.append((path, params))
+            return SimpleNamespace(raise_for_status=lambda: None, json=lambda: rows)
+
+    monkeypatch.setattr(chat, "get_postgrest_async", lambda: FakePostgrest())
+    history = asyncio.run(chat._fetch_db_history("conv-1"))
+
+    assert history == [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+    assert requests[0][0] == "/messages"
+    assert requests[0][1]["conversation_id"] == "eq.conv-1"
+
+
+def test_extract_sheet_action():
+    """Test that a sheetaction block is parsed out of the response text."""
+    from app.api.routes.chat import _extract_sheet_action
+
+    text = 'Done.\n```sheetaction\n{"action": "sort", "column": "B"}\n```\nAnything else?'
+    cleaned, action = _extract_sheet_action(text)
+    assert action == {"action": "sort", "column": "B"}
+    assert cleaned == "Done.\nAnything else?"
+
+    assert _extract_sheet_action("No actions here.") == ("No actions here.", None)
+
+
+def test_detect_clarification_uses_trailing_question():
+    """Test that only a question near the end of the response offers options."""
+    from app.api.routes.chat import _detect_clarification
+
+    meta = {"columns": [{"letter": "A", "header": "Profit", "type": "number"}]}
+    result = _detect_clarification("I can total it.\n\n- Which column should I use?\n", meta)
+    assert result["type"] == "column"
+    assert result["question"] == "Which column should I use?"
+
+    early = "Which column?\nOne.\nTwo.\nThree."
+    assert _detect_clarification(early, meta) is None
+
+
+def test_new_uuid_is_valid_v4():
+    """Test that _new_uuid produces canonical version-4 UUIDs accepted by _UUID_RE."""
+    import uuid
+    from app.api.routes.chat import _UUID_RE, _new_uuid
+
+    for _ in range(100):
+        value = _new_uuid()
+        parsed = uuid.UUID(value)
+        assert str(parsed) == value
+        assert parsed.version == 4 and parsed.variant == uuid.RFC_4122
+        assert _UUID_RE.fullmatch(value)
+    assert not _UUID_RE.fullmatch("1; drop table conversations")
+
+
+def test_stream_llm_forwards_chunks_and_errors():
+    """Test that _stream_llm relays chunks from a blocking generator in order."""
+    import asyncio
+    from app.api.routes.chat import _stream_llm
+
+    def tokens(n):
+        for i in range(n):
+            yield f"t{i}"
+
+    def failing():
+        yield "partial"
+        raise RuntimeError("provider down")
+
+    async def collect(fn, *args):
+        out = []
+        try:
+            async for chunk in _stream_llm(fn, *args):
+                out.append(chunk)
+        except RuntimeError as e:
+            out.append(str(e))
+        return out
+
+    assert asyncio.run(collect(tokens, 3)) == ["t0", "t1", "t2"]
+    assert asyncio.run(collect(failing)) == ["partial", "provider down"]
+
+
+def test_chat_stream_emits_extras_as_events(monkeypatch):
+    """Test that /chat/stream sends quick actions, chart and done as separate events."""
+    import orjson
+    import app.api.routes.chat as chat
+    from app.core.auth import get_current_user
+
+    async def admit(*args):
+        return None, None
+
+    async def stream_llm(fn, **kwargs):
+        for chunk in ("Total ", "is 10."):
+            yield chunk
+
+    async def run_llm(fn, *args):
+        return {"type": "bar"}
+
+    monkeypatch.setattr(chat, "_admit_chat_request", admit)
+    monkeypatch.setattr(chat, "_stream_llm", stream_llm)
+    monkeypatch.setattr(chat, "_run_llm", run_llm)
+    persisted = []
+    monkeypatch.setattr(chat, "_schedule_persist", lambda *args: persisted.append(args))
+    monkeypatch.setattr(chat, "set_cached_semantic", lambda **kwargs: None)
+    monkeypatch.setattr(chat, "get_supabase", lambda: None)
+    app.dependency_overrides[get_current_user] = lambda: {"id": "u1", "tier": "pro"}
+    try:
+        response = client.post("/api/chat/stream", json={
+            "message": "make a chart of sales by region",
+            "sheet_data": {"cells": {"A1": "Region", "B1": "Sales", "A2": "East", "B2": 10}},
+        })
+    finally:
+        app.dependency_overrides.pop(get_current_user)
+
+    events = [line[len("event: "):] for line in response.text.splitlines() if line.startswith("event: ")]
+    assert events[0] == "quick_actions"
+    assert events.count("token") == 2
+    assert "chart" in events
+    assert events[-1] == "done"
+    # New conversation: id chosen up front, row created with the first exchange
+    done = orjson.loads(response.text.rstrip().rsplit("data: ", 1)[1])
+    assert chat._UUID_RE.fullmatch(done["conversation_id"])
+    assert persisted[0][1] == done["conversation_id"]
+    assert persisted[0][-1] == "make a chart of sales by region"
+    # Unset optional fields are left out rather than sent as null
+    assert None not in done.values()
+
+
+def test_chat_body_errors_are_reported_like_fastapi():
+    """Test that the raw-bytes ChatRequest body still yields 422s located in the body."""
+    from app.core.auth import get_current_user
+
+    app.dependency_overrides[get_current_user] = lambda: {"id": "u1", "tier": "pro"}
+    try:
+        bad_json = client.post("/api/chat/query", content=b"{not json")
+        too_long = client.post("/api/chat/query", json={"message": "x" * 5001})
+    finally:
+        app.dependency_overrides.pop(get_current_user)
+
+    assert bad_json.status_code == 422
+    assert bad_json.json()["detail"][0]["type"] == "json_invalid"
+    assert too_long.status_code == 422
+    assert too_long.json()["detail"][0]["loc"] == ["body", "message"]
+
+
+def test_chat_body_over_limit_rejected_before_parsing(monkeypatch):
+    """Test that an oversized chat body gets a 413 without being parsed."""
+    from app.core.auth import get_current_user
+    from app.schemas.message import ChatRequest
+
+    def parse(body):
+        raise AssertionError("oversized body was parsed")
+
+    monkeypatch.setattr(ChatRequest, "MAX_BODY_BYTES", 1000)
+    monkeypatch.setattr(ChatRequest, "from_request_bytes", parse)
+    app.dependency_overrides[get_current_user] = lambda: {"id": "u1", "tier": "pro"}
+    try:
+        response = client.post("/api/chat/query", content=b'{"message": "' + b"x" * 2000 + b'"}')
+    finally:
+        app.dependency_overrides.pop(get_current_user)
+
+    assert response.status_code == 413
+
+
+# =============================================================================
+# Response Cache Tests
+# =============================================================================
+
+class _FakeRedis:
+    """In-memory stand-in for the handful of Redis calls the cache makes."""
+
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def setex(self, key, ttl, value):
+        self.store[key] = value
+
+    def lrange(self, key, start, end):
+        return list(self.store.get(key, []))
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def lpush(self, key, value):
+        self.store.setdefault(key, []).insert(0, value)
+
+    def ltrim(self, key, start, end):
+        self.store[key] = self.store.get(key, [])[start:end + 1]
+
+    def expire(self, key, ttl):
+        pass
+
+    def execute(self):
+        pass
+
+
+def test_semantic_cache_matches_reworded_prompt(monkeypatch):
+    """Test that a reworded prompt hits, but a different column does not."""
+    from array import array
+    import app.services.cache as cache
+
+    vectors = {
+        "sum column a": [1.0, 0.0],
+        "add up column a": [0.99, 0.141],
+        "sum column b": [1.0, 0.0],
+    }
+    monkeypatch.setattr(cache, "_get_redis", lambda: fake)
+    monkeypatch.setattr(cache, "_embed_prompt", lambda p: array("f", vectors[p]))
+    fake = _FakeRedis()
+
+    data = {"cells": {"A1": "Sales"}}
+    cache.set_cached_semantic("u1", "chat", "sum column a", {"content": "42"}, data)
+
+    assert cache.get_cached_semantic("u1", "chat", "sum column a", data) == {"content": "42"}
+    assert cache.get_cached_semantic("u1", "chat", "add up column a", data) == {"content": "42"}
+    assert cache.get_cached_semantic("u1", "chat", "sum column b", data) is None
+    assert cache.get_cached_semantic("u1", "chat", "add up column a", {"cells": {}}) is None
+    assert cache.get_cached_semantic("u2", "chat", "add up column a", data) is None
+
+
+def test_semantic_cache_keeps_opposite_operations_apart(monkeypatch):
+    """Test that prompts differing only by operation, header or filter value never share an answer."""
+    from array import array
+    import app.services.cache as cache
+
+    monkeypatch.setattr(cache, "_get_redis", lambda: fake)
+    # Worst case: the embeddings can't tell any of these prompts apart
+    monkeypatch.setattr(cache, "_embed_prompt", lambda p: array("f", [1.0, 0.0]))
+    fake = _FakeRedis()
+
+    data = [["Region", "Revenue", "Profit"], ["North", 10, 2], ["South", 30, 5]]
+    cache.set_cached_semantic("u1", "formula_execute", "min of revenue", {"result": "10"}, data)
+    cache.set_cached_semantic("u1", "formula_execute", "total revenue", {"result": "40"}, data)
+
+    assert cache.get_cached_semantic("u1", "formula_execute", "max of revenue", data) is None
+    assert cache.get_cached_semantic("u1", "formula_execute", "total profit", data) is None
+    assert cache.get_cached_semantic("u1", "formula_execute", "average revenue", data) is None
+    assert cache.get_cached_semantic("u1", "formula_execute", "lowest revenue", data) == {"result": "10"}
+
+    cache.set_cached_semantic("u1", "formula_execute", "total revenue for north", {"result": "10"}, data)
+    cache.set_cached_semantic("u1", "chat", "total sales in january", {"content": "7"}, data)
+    assert cache.get_cached_semantic("u1", "formula_execute", "total revenue for south", data) is None
+    assert cache.get_cached_semantic("u1", "formula_execute", "sum of revenue for north", data) == {"result": "10"}
+    assert cache.get_cached_semantic("u1", "chat", "total sales in february", data) is None
+    assert cache.get_cached_semantic("u1", "chat", "total sales in jan", data) == {"content": "7"}
+
+
+def test_cached_values_exclude_request_fields(monkeypatch):
+    """Test that profile data and sheet payloads are never stored in cache values."""
+    import app.services.cache as cache
+
+    fake = _FakeRedis()
+    monkeypatch.setattr(cache, "_get_redis", lambda: fake)
+
+    data = {"cells": {"A1": "Sales"}}
+    response = {"fixed_formula": "=SUM(A:A)", "_profile": {"steps": {}}, "sheet_data": data}
+    cache.set_cached("u1", "formula_fix", "=SUM(A:A", response, data)
+
+    assert cache.get_cached("u1", "formula_fix", "=SUM(A:A", data) == {"fixed_formula": "=SUM(A:A)"}
+    assert "_profile" in response  # caller's dict is left alone
+
+
+def test_background_cache_writes_are_kept_and_logged(caplog):
+    """Test that fire-and-forget cache writes stay referenced until done and log failures."""
+    import asyncio
+    import app.services.cache as cache
+
+    def failing_write(**_):
+        raise ConnectionError("redis down")
+
+    async def run():
+        cache.set_cached_in_background(failing_write, user_id="u1")
+        assert len(cache._background_writes) == 1
+        while cache._background_writes:
+            await asyncio.sleep(0.01)
+
+    with caplog.at_level("WARNING", logger=cache.logger.name):
+        asyncio.run(run())
+    assert "redis down" in caplog.text
+
+
+# =============================================================================
+# Direct Answer Tests
+# =============================================================================
+
+def test_direct_answer_aggregates_explicit_range():
+    """Test that range aggregates are computed locally and everything else falls through."""
+    from app.services.direct_answer import try_direct_answer
+
+    sheet = {"dataRange": "A1:B4", "totalRows": 4, "totalColumns": 2,
+             "cells": {"A1": "Item", "B1": "Cost", "B2": "10", "B3": "n/a", "B4": "2.5"}}
+
+    kind, answer = try_direct_answer("What is the sum of B2:B4?", sheet, "Sheet1")
+    assert kind == "aggregate"
+    assert "**12.5**" in answer and "=SUM(B2:B4)" in answer
+
+    assert try_direct_answer("how many rows are there?", sheet, "Sheet1")[0] == "size"
+    assert try_direct_answer("hello!", None, None)[0] == "greeting"
+    assert try_direct_answer("sum of cost by item", sheet, "Sheet1") is None
+
+    # Rows past a truncated read are not answered from partial data
+    truncated = dict(sheet, dataRange="A1:B5000")
+    assert try_direct_answer("sum B2:B4000", truncated, "Sheet1") is None
+
+
+# =============================================================================
+# AI Provider Tests
+# =============================================================================
+
+def test_context_stops_building_at_char_limit():
+    """Test that a capped sheet context is built only as far as the limit needs."""
+    from app.services.ai_provider import _build_context_message, _truncate
+
+    cells = {f"{col}{row}": f"value {row}" for row in range(1, 2001) for col in "ABC"}
+    sheet = {"cells": cells}
+    full = _build_context_message(sheet, "Sheet1")
+    capped = _build_context_message(sheet, "Sheet1", 5000)
+
+    assert len(capped) < len(full) // 10
+    assert _truncate(capped, 5000) == _truncate(full, 5000)
+
+
+def test_build_messages_keeps_stable_prefix():
+    """Test that only the last message changes between turns on the same sheet."""
+    from app.services.ai_provider import _build_messages, SYSTEM_PROMPT
+
+    history = [{"role": "user", "content": "Total sales by region please"},
+               {"role": "assistant", "content": "North: 10, South: 20"}]
+    first = _build_messages(SYSTEM_PROMPT, "Total sales by region please", "A1: Region", [])
+    second = _build_messages(SYSTEM_PROMPT, "Now show the average for each region", "A1: Region", history)
+
+    assert first[:2] == second[:2]
+    assert second[0] == {"role": "system", "content": SYSTEM_PROMPT}
+    assert second[1]["role"] == "system" and "A1: Region" in second[1]["content"]
+    assert second[-1] == {"role": "user", "content": "Now show the average for each region"}
+
+
+def test_formula_answers_cached_in_process(monkeypatch):
+    """Test that repeat explain/fix calls reuse the answer unless it was unusable."""
+    import app.services.ai_provider as ai
+
+    calls = []
+
+    def call(system_prompt, user_message, context, label=""):
+        calls.append(label)
+        return "not json" if label == "fix" else "Adds A1 and A2."
+
+    monkeypatch.setattr(ai, "_call_with_fallback", call)
+    monkeypatch.setattr(ai, "_answer_cache", {})
+
+    assert ai.explain_formula("=A1+A2") == "Adds A1 and A2."
+    assert ai.explain_formula("  =A1+A2\n") == "Adds A1 and A2."
+    assert calls == ["explain"]
+
+    # An answer that can't be parsed is not kept
+    ai.fix_formula("=SUM(A1:A", "Formula parse error")
+    ai.fix_formula("=SUM(A1:A", "Formula parse error")
+    assert calls == ["explain", "fix", "fix"]
+
+
+def test_provider_clients_are_shared(monkeypatch):
+    """Test that the model clients (and their connection pools) are reused."""
+    from app.core.config import settings
+    from app.services.ai_provider import _get_gemini_client, _get_openrouter_client
+
+    monkeypatch.setattr(settings, "GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(settings, "OPENROUTER_API_KEY", "test-key")
+    _get_gemini_client.cache_clear()
+    _get_openrouter_client.cache_clear()
+
+    assert _get_openrouter_client() is _get_openrouter_client()
+    assert _get_gemini_client() is _get_gemini_client()
+    assert _get_gemini_client() is not _get_openrouter_client()
+
+    _get_gemini_client.cache_clear()
+    _get_openrouter_client.cache_clear()
+
+
+def test_fallback_chain_hedges_slow_model(monkeypatch):
+    """Test that a stalled model is raced by the next one, then cancelled."""
+    import threading
+    import app.services.ai_provider as ai
+    from app.core.config import settings
+
+    calls = []
+    cancelled = threading.Event()
+
+    def call(model, system_prompt, user_message, context, client=None, history=None,
+             stop_on_refusal=False, first_chunk=None, cancel=None):
+        calls.append(model)
+        if model == ai.PRIMARY_OR_MODEL:
+            # Stalls before its first chunk until the winner cancels it
+            if cancel.wait(5):
+                cancelled.set()
+            return ""
+        first_chunk.set()
+        if model == ai.FALLBACK_MODEL:
+            return "I cannot view the spreadsheet."
+        return "GPT answer"
+
+    monkeypatch.setattr(ai, "_call_model", call)
+    monkeypatch.setattr(ai, "_get_openrouter_client", lambda: None)
+    monkeypatch.setattr(settings, "GEMINI_ENABLED", False)
+    monkeypatch.setattr(settings, "LLM_HEDGE_DELAY", 0.05)
+
+    assert ai._call_with_fallback("system", "hi", "") == "GPT answer"
+    assert calls == [ai.PRIMARY_OR_MODEL, ai.FALLBACK_MODEL, ai.GPT_FALLBACK_MODEL]
+    assert cancelled.wait(1)
+
+
+def test_fallback_chain_does_not_hedge_a_streaming_model(monkeypatch):
+    """Test that a model that has started answering is not raced, however long it takes."""
+    import time
+    import app.services.ai_provider as ai
+    from app.core.config import settings
+
+    calls = []
+
+    def call(model, system_prompt, user_message, context, client=None, history=None,
+             stop_on_refusal=False, first_chunk=None, cancel=None):
+        calls.append(model)
+        first_chunk.set()
+        time.sleep(0.3)
+        return "long answer"
+
+    monkeypatch.setattr(ai, "_call_model", call)
+    monkeypatch.setattr(ai, "_get_openrouter_client", lambda: None)
+    monkeypatch.setattr(settings, "GEMINI_ENABLED", False)
+    monkeypatch.setattr(settings, "LLM_HEDGE_DELAY", 0.05)
+
+    assert ai._call_with_fallback("system", "hi", "") == "long answer"
+    assert calls == [ai.PRIMARY_OR_MODEL]
+
+
+def test_call_model_stops_reading_a_refusal():
+    """Test that _call_model closes the stream once the reply reads as a refusal."""
+    from types import SimpleNamespace
+    import app.services.ai_provider as ai
+
+    def make_client(chunks, read):
+        def events():
+            for text in chunks:
+                read.append(text)
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+        class Stream:
+            def __init__(self):
+                self._events = events()
+
+            def __iter__(self):
+                return self._events
+
+            def close(self):
+                self._events.close()
+
+        create = lambda **kwargs: Stream()
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    refusal = ["I cannot view your spreadsheet. " * 10] + ["more text "] * 50
+    read = []
+    text = ai._call_model("m", "sys", "hi", "", make_client(refusal, read), stop_on_refusal=True)
+    assert ai._is_refusal(text)
+    assert len(read) == 1
+
+    answer = ["The total ", "is 42."]
+    read = []
+    assert ai._call_model("m", "sys", "hi", "", make_client(answer, read), stop_on_refusal=True) == "The total is 42."
+    assert read == answer
+
+    # A cancelled attempt (another model already won) never opens its stream
+    import threading
+    cancel = threading.Event()
+    cancel.set()
+    read = []
+    assert ai._call_model("m", "sys", "hi", "", make_client(answer, read), cancel=cancel) == ""
+    assert read == []
+
+
+# =============================================================================
+# RAG Tests
+# =============================================================================
+
+def test_rag_reindex_only_embeds_changed_rows(monkeypatch, tmp_path):
+    """Test that re-indexing an edited sheet reuses cached row embeddings."""
+    pytest.importorskip("chromadb")
+    import app.services.rag_system as rag_system
+
+    embedded = []
+
+    class FakeEmbeddings:
+        def embed_documents(self, texts):
+            embedded.extend(texts)
+            return [[float(len(t)), 1.0, 0.5] for t in texts]
+
+        def embed_query(self, text):
+            return [float(len(text)), 1.0, 0.5]
+
+    monkeypatch.setattr(rag_system, "CHROMA_DIR", tmp_path)
+    monkeypatch.setattr(rag_system, "_row_vectors", {})
+    monkeypatch.setattr(rag_system, "_get_embeddings", lambda: (FakeEmbeddings(), "fake"))
+
+    cells = {"A1": "Name", "B1": "Amount"}
+    for row in range(2, 12):
+        cells[f"A{row}"] = f"Person {row}"
+        cells[f"B{row}"] = str(row * 10)
+
+    rag = rag_system.SheetRAG()
+    assert rag.index_sheet(cells, "Data")["indexed"] == 10
+    assert len(embedded) == 10
+
+    embedded.clear()
+    assert rag.index_sheet({**cells, "B5": "999"}, "Data")["indexed"] == 10
+    assert len(embedded) == 1 and "999" in embedded[0]
+
+
 # =============================================================================
 # Formula Patterns Tests
 # =============================================================================